@@ -16,16 +16,20 @@ if __name__ == '__main__':
         sys.exit()
     settings.CUSTOM_EMAIL = settings.MONITORING_EMAIL if settings.MONITORING_EMAIL and settings.MONITORING else ""
 
-from twisted.internet import reactor, defer, protocol
+from twisted.internet import reactor, defer, protocol, task
 from twisted.internet import reactor as reactor2
 from stratum.socket_transport import SocketTransportFactory, SocketTransportClientFactory
 from stratum.services import ServiceEventHandler
 from twisted.web.server import Site
-from stratum.custom_exceptions import TransportException
+from stratum.custom_exceptions import TransportException, TimeoutServiceException, RemoteServiceException
 
 from mining_libs import getwork_listener
+from mining_libs import stratum_listener
+from mining_libs import ethstratum_listener
+from mining_libs import ethash
 from mining_libs import client_service
 from mining_libs import jobs
+from mining_libs import processes
 from mining_libs import version
 
 def on_shutdown(f):
@@ -35,44 +39,77 @@ def on_shutdown(f):
         os.remove('eth-proxy.pid')
     f.is_reconnecting = False # Don't let stratum factory to reconnect again
 
-# Support main connection
+# Support main connection, it's also heartbeat of pool health checks and round-trip time is measured for pool selection
 @defer.inlineCallbacks
-def ping(f):
+def ping(f, job_registry):
     if not f.is_reconnecting:
         return
     try:
+        start = time.time()
+        job_registry.health.on_ping_sent(f.pool_number)
         yield (f.rpc('eth_getWork', [], ''))
-        if f.is_failover:
-            reactor.callLater(30, ping, f)
+        job_registry.latency.add_rtt(f.pool_number, time.time() - start)
+        job_registry.health.on_ping_reply(f.pool_number, time.time() - start)
+        if settings.POOL_FAILOVER_TIMEOUT:
+            reactor.callLater(settings.POOL_HEARTBEAT_INTERVAL / 1000.0, ping, f, job_registry)
+        elif f.is_failover and settings.POOL_SELECTION != 'latency':
+            reactor.callLater(30, ping, f, job_registry)
         else:
-            reactor.callLater(5, ping, f)
+            reactor.callLater(5, ping, f, job_registry)
     except Exception:
         pass
 
 @defer.inlineCallbacks
-def on_connect(f):
+def on_connect(f, job_registry):
     '''Callback when proxy get connected to the pool'''
     log.info("Connected to Stratum pool at %s:%d" % f.main_host)
     f.is_connected = True
     f.remote_ip = f.client._get_ip()
+    job_registry.health.on_connect(f.pool_number)
     #reactor.callLater(30, f.client.transport.loseConnection)
 
     # Hook to on_connect again
-    f.on_connect.addCallback(on_connect)
+    f.on_connect.addCallback(on_connect, job_registry)
 
     # Get first job and user_id
     debug = "_debug" if settings.DEBUG else ""
-    initial_job = (yield f.rpc('eth_submitLogin', [settings.WALLET, settings.CUSTOM_EMAIL], 'Proxy_'+version.VERSION+debug))
+    try:
+        initial_job = (yield f.rpc('eth_submitLogin', [settings.WALLET, settings.CUSTOM_EMAIL], 'Proxy_'+version.VERSION+debug))
+    except (TransportException, TimeoutServiceException, RemoteServiceException) as e:
+        log.warning("Login to Stratum pool at %s:%d failed: %s" % (f.main_host[0], f.main_host[1], e))
+        if f.client and f.client.transport:
+            # Reconnect and log in again
+            f.client.transport.loseConnection()
+        defer.returnValue(f)
+    job_registry.flush_replay_queue(f)
 
-    reactor.callLater(0, ping, f)
+    reactor.callLater(0, ping, f, job_registry)
 
     defer.returnValue(f)
 
-def on_disconnect(f):
+def on_connect_timeout(failure, f, job_registry):
+    '''Failover pool wasn't reachable on start, it's still being reconnected'''
+    failure.trap(TransportException)
+    log.warning("Failover Stratum pool at %s:%d is not reachable, still trying" % f.main_host)
+    f.on_connect.addCallback(on_connect, job_registry)
+
+def on_disconnect(f, job_registry):
     '''Callback when proxy get disconnected from the pool'''
     log.info("Disconnected from Stratum pool at %s:%d" % f.main_host)
     f.is_connected = False
-    f.on_disconnect.addCallback(on_disconnect)
+    job_registry.health.on_disconnect(f.pool_number)
+    f.on_disconnect.addCallback(on_disconnect, job_registry)
+
+def get_pool_addresses():
+    '''Main pool and failovers POOL_HOST_FAILOVER1, 2, ... in priority order, as many as configured'''
+    addresses = [(settings.POOL_HOST, settings.POOL_PORT)]
+    number = 1
+    while settings.POOL_FAILOVER_ENABLE and hasattr(settings, 'POOL_HOST_FAILOVER%d' % number):
+        host = getattr(settings, 'POOL_HOST_FAILOVER%d' % number)
+        if host:
+            addresses.append((host, getattr(settings, 'POOL_PORT_FAILOVER%d' % number)))
+        number += 1
+    return addresses
 
 @defer.inlineCallbacks
 def main():
@@ -80,81 +117,86 @@ def main():
 
     log.warning("Ethereum Stratum proxy version: %s" % version.VERSION)
 
-    # Connect to Stratum pool, main monitoring connection
-    log.warning("Trying to connect to Stratum pool at %s:%d" % (settings.POOL_HOST, settings.POOL_PORT))
-    f = SocketTransportClientFactory(settings.POOL_HOST, settings.POOL_PORT,
-                debug=settings.DEBUG, proxy=None,
-                event_handler=client_service.ClientMiningService)
-
-    f1 = None
-    f2 = None
-    f3 = None
-    if settings.POOL_FAILOVER_ENABLE:
-        log.warning("Trying to connect to failover Stratum pool-1 at %s:%d" % (settings.POOL_HOST_FAILOVER1, settings.POOL_PORT_FAILOVER1))
-        f1 = SocketTransportClientFactory(settings.POOL_HOST_FAILOVER1, settings.POOL_PORT_FAILOVER1,
-                debug=settings.DEBUG, proxy=None,
-                event_handler=client_service.ClientMiningService)
-        f1.is_failover = True
-
-        log.warning("Trying to connect to failover Stratum pool-2 at %s:%d" % (settings.POOL_HOST_FAILOVER2, settings.POOL_PORT_FAILOVER2))
-        f2 = SocketTransportClientFactory(settings.POOL_HOST_FAILOVER2, settings.POOL_PORT_FAILOVER2,
-                debug=settings.DEBUG, proxy=None,
-                event_handler=client_service.ClientMiningService)
-        f2.is_failover = True
-
-        log.warning("Trying to connect to failover Stratum pool-3 at %s:%d" % (settings.POOL_HOST_FAILOVER3, settings.POOL_PORT_FAILOVER3))
-        f3 = SocketTransportClientFactory(settings.POOL_HOST_FAILOVER3, settings.POOL_PORT_FAILOVER3,
+    # Connect to Stratum pool, main monitoring connection, and to failover pools
+    pools = []
+    for (host, port) in get_pool_addresses():
+        if pools:
+            log.warning("Trying to connect to failover Stratum pool-%d at %s:%d" % (len(pools), host, port))
+            connect_timeout = settings.POOL_CONNECT_TIMEOUT
+        else:
+            log.warning("Trying to connect to Stratum pool at %s:%d" % (host, port))
+            # Proxy quits when main pool isn't reached on start, keep the usual 30s for it
+            connect_timeout = 30
+        f = SocketTransportClientFactory(host, port,
                 debug=settings.DEBUG, proxy=None,
-                event_handler=client_service.ClientMiningService)
-        f3.is_failover = True
-
-    job_registry = jobs.JobRegistry(f,f1,f2,f3)
+                event_handler=client_service.ClientMiningService,
+                connect_timeout=connect_timeout,
+                initial_delay=settings.POOL_RECONNECT_DELAY / 1000.0,
+                max_delay=settings.POOL_RECONNECT_MAX_DELAY, jitter=0.3)
+        f.pool_number = len(pools)
+        f.is_failover = f.pool_number > 0
+        pools.append(f)
+
+    job_registry = jobs.JobRegistry(pools)
     client_service.ClientMiningService.job_registry = job_registry
     client_service.ClientMiningService.reset_timeout()
-
-    f.on_connect.addCallback(on_connect)
-    f.on_disconnect.addCallback(on_disconnect)
-    # Cleanup properly on shutdown
-    reactor.addSystemEventTrigger('before', 'shutdown', on_shutdown, f)
-    if f1:
-        f1.on_connect.addCallback(on_connect)
-        f1.on_disconnect.addCallback(on_disconnect)
-        reactor.addSystemEventTrigger('before', 'shutdown', on_shutdown, f1)
-
-    if f2:
-        f2.on_connect.addCallback(on_connect)
-        f2.on_disconnect.addCallback(on_disconnect)
-        reactor.addSystemEventTrigger('before', 'shutdown', on_shutdown, f2)
-
-    if f3:
-        f3.on_connect.addCallback(on_connect)
-        f3.on_disconnect.addCallback(on_disconnect)
-        reactor.addSystemEventTrigger('before', 'shutdown', on_shutdown, f3)
-
+    job_registry.hashrates.start()
+    job_registry.health.start()
+    if job_registry.journal:
+        restored = job_registry.journal.restore(job_registry.workers, settings.JOURNAL_RESTORE_AGE)
+        log.info("Worker counters restored from %d journal records" % restored)
+        job_registry.journal.start()
+        reactor.addSystemEventTrigger('before', 'shutdown', job_registry.journal.stop)
+
+    if settings.POOL_SELECTION == 'latency':
+        # Faster pool may take over, see LatencyTable.select()
+        task.LoopingCall(job_registry.update_active_pool).start(5, now=False)
+
+    for f in pools:
+        f.on_connect.addCallback(on_connect, job_registry)
+        if f.is_failover:
+            f.on_connect.addErrback(on_connect_timeout, f, job_registry)
+        f.on_disconnect.addCallback(on_disconnect, job_registry)
+        # Cleanup properly on shutdown
+        reactor.addSystemEventTrigger('before', 'shutdown', on_shutdown, f)
 
     # Block until proxy connect to the pool
     try:
-        yield f.on_connect
+        yield pools[0].on_connect
     except TransportException:
         log.warning("First pool server must be online first time during start")
         return
 
 
-    conn = reactor.listenTCP(settings.PORT, Site(getwork_listener.Root(job_registry, settings.ENABLE_WORKER_ID)), interface=settings.HOST)
+    if settings.WORKER_PROCESSES and not hasattr(socket, 'SO_REUSEPORT'):
+        log.error("WORKER_PROCESSES needs SO_REUSEPORT which this platform doesn't have, serving miners from one process")
+        settings.WORKER_PROCESSES = 0
 
-    try:
-        conn.socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1) # Enable keepalive packets
-        conn.socket.setsockopt(socket.SOL_TCP, socket.TCP_KEEPIDLE, 60) # Seconds before sending keepalive probes
-        conn.socket.setsockopt(socket.SOL_TCP, socket.TCP_KEEPINTVL, 1) # Interval in seconds between keepalive probes
-        conn.socket.setsockopt(socket.SOL_TCP, socket.TCP_KEEPCNT, 5) # Failed keepalive probles before declaring other end dead
-    except:
-        pass # Some socket features are not available on all platforms (you can guess which one)
+    if settings.WORKER_PROCESSES:
+        processes.WorkerPool(job_registry, settings.WORKER_PROCESSES).start()
+    else:
+        conn = reactor.listenTCP(settings.PORT, Site(getwork_listener.Root(job_registry, settings.ENABLE_WORKER_ID)), interface=settings.HOST)
+        processes.set_keepalive(conn.socket)
+
+    if settings.STRATUM_PORT:
+        reactor.listenTCP(settings.STRATUM_PORT, stratum_listener.StratumListenerFactory(job_registry, debug=settings.DEBUG), interface=settings.HOST)
+
+    if settings.ETHSTRATUM_PORT and not ethash.pyethash:
+        log.error("EthereumStratum port needs pyethash package to compute mix digest of shares, port is disabled")
+    elif settings.ETHSTRATUM_PORT:
+        reactor.listenTCP(settings.ETHSTRATUM_PORT, ethstratum_listener.EthStratumListenerFactory(job_registry, debug=settings.DEBUG), interface=settings.HOST)
 
     log.warning("-----------------------------------------------------------------------")
     if settings.HOST == '0.0.0.0':
         log.warning("PROXY IS LISTENING ON ALL IPs ON PORT %d" % settings.PORT)
     else:
         log.warning("LISTENING FOR MINERS ON http://%s:%d" % (settings.HOST, settings.PORT))
+    if settings.WORKER_PROCESSES:
+        log.warning("MINERS ARE SERVED BY %d WORKER PROCESSES" % settings.WORKER_PROCESSES)
+    if settings.STRATUM_PORT:
+        log.warning("LISTENING FOR STRATUM MINERS ON stratum+tcp://%s:%d" % (settings.HOST, settings.STRATUM_PORT))
+    if settings.ETHSTRATUM_PORT and ethash.pyethash:
+        log.warning("LISTENING FOR ETHEREUMSTRATUM/1.0.0 MINERS ON stratum+tcp://%s:%d" % (settings.HOST, settings.ETHSTRATUM_PORT))
     log.warning("-----------------------------------------------------------------------")
     log.warning("Wallet: %s" % settings.WALLET)
     log.warning("Worker ID enabled: %s" % settings.ENABLE_WORKER_ID)
@@ -162,12 +204,16 @@ def main():
         log.warning("Email monitoring on %s" % settings.MONITORING_EMAIL)
     else:
         log.warning("Email monitoring disabled")
-    log.warning("Failover enabled: %s" % settings.POOL_FAILOVER_ENABLE)
+    log.warning("Failover enabled: %s (%d failover pools), pool selection by %s" % (settings.POOL_FAILOVER_ENABLE, len(pools)-1, settings.POOL_SELECTION))
     log.warning("-----------------------------------------------------------------------")
 
 if __name__ == '__main__':
-    fp = file("eth-proxy.pid", 'w')
-    fp.write(str(os.getpid()))
-    fp.close()
-    main()
+    if len(sys.argv) > 2 and sys.argv[1] == '--worker':
+        # Child of WORKER_PROCESSES mode, see mining_libs/processes.py
+        processes.worker_main(int(sys.argv[2]))
+    else:
+        fp = file("eth-proxy.pid", 'w')
+        fp.write(str(os.getpid()))
+        fp.close()
+        main()
     reactor.run()
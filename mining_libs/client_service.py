@@ -29,14 +29,9 @@ class ClientMiningService(GenericEventHandler):
         '''
         log.error("Connection to upstream pool timed out")
         cls.reset_timeout()
-        if not cls.job_registry.f.is_connected:
-            cls.job_registry.f.reconnect()
-        if cls.job_registry.f1 and not cls.job_registry.f1.is_connected:
-            cls.job_registry.f1.reconnect()
-        if cls.job_registry.f2 and not cls.job_registry.f2.is_connected:
-            cls.job_registry.f2.reconnect()
-        if cls.job_registry.f3 and not cls.job_registry.f3.is_connected:
-            cls.job_registry.f3.reconnect()
+        for f in cls.job_registry.pools:
+            if not f.is_connected:
+                f.reconnect()
 
     def handle_event(self, method, params, connection_ref):
         '''Handle RPC calls and notifications from the pool'''
@@ -0,0 +1,92 @@
+'''Ethash light evaluation of shares, needs optional pyethash package'''
+
+import os
+import mmap
+import threading
+from collections import OrderedDict
+
+try:
+    import pyethash
+except ImportError:
+    pyethash = None
+
+import stratum.logger
+log = stratum.logger.get_logger('proxy')
+
+class EthashLight(object):
+    '''Keeps light caches of last few epochs, keyed by seed hash.
+    If cache_dir is set, every cache is generated once, stored on disk
+    and mapped to memory on next use, so restart doesn't regenerate it.
+    Cache generation takes seconds, so call it from thread, never from reactor.'''
+
+    def __init__(self, cache_dir=None, max_caches=2):
+        self.cache_dir = cache_dir
+        self.max_caches = max_caches
+        self.caches = OrderedDict() # seed hash -> (block_number, cache bytes or mmap)
+        self.seeds = [] # seed hash of every epoch, index is epoch number
+        self.lock = threading.Lock()
+
+    def get_epoch(self, seedhash):
+        '''Epoch number for given seed hash (0x-prefixed hex)'''
+        seed = seedhash[2:].decode('hex')
+        try:
+            return self.seeds.index(seed)
+        except ValueError:
+            pass
+        while len(self.seeds) < 2048:
+            self.seeds.append(pyethash.get_seedhash(len(self.seeds)*pyethash.EPOCH_LENGTH))
+            if self.seeds[-1] == seed:
+                return len(self.seeds)-1
+        raise ValueError("Unknown seed hash %s" % seedhash)
+
+    def load_cache(self, block_number, seedhash):
+        if not self.cache_dir:
+            log.info("Generating ethash cache for epoch %d" % (block_number/pyethash.EPOCH_LENGTH))
+            return pyethash.mkcache_bytes(block_number)
+
+        path = os.path.join(self.cache_dir, "cache-R%d-%s" % (pyethash.REVISION, seedhash[2:18]))
+        if not os.path.isfile(path):
+            log.info("Generating ethash cache for epoch %d into %s" % (block_number/pyethash.EPOCH_LENGTH, path))
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            fp = open(path+'.tmp', 'wb')
+            fp.write(pyethash.mkcache_bytes(block_number))
+            fp.close()
+            # Never leave half written cache behind on crash
+            os.rename(path+'.tmp', path)
+
+        fp = open(path, 'rb')
+        try:
+            return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fp.close()
+
+    def get_cache(self, seedhash):
+        with self.lock:
+            if seedhash in self.caches:
+                return self.caches[seedhash]
+            block_number = self.get_epoch(seedhash)*pyethash.EPOCH_LENGTH
+            self.caches[seedhash] = (block_number, self.load_cache(block_number, seedhash))
+            while len(self.caches) > self.max_caches:
+                self.caches.popitem(last=False)
+            return self.caches[seedhash]
+
+    def hashimoto(self, seedhash, header, nonce):
+        '''Returns (mix digest, result) as 0x-prefixed hex of share given by hex header and nonce'''
+        block_number, cache = self.get_cache(seedhash)
+        res = pyethash.hashimoto_light(block_number, cache, header[2:].decode('hex'), int(nonce, 16))
+        return ('0x'+res['mix digest'].encode('hex'), '0x'+res['result'].encode('hex'))
+
+    def verify(self, seedhash, boundary, nonce, header, mix_digest):
+        '''Returns None for valid share, otherwise reason why it is invalid'''
+        if len(str(nonce)) != 18 or len(str(header)) != 66 or len(str(mix_digest)) != 66:
+            return "malformed share"
+        try:
+            (mix, result) = self.hashimoto(seedhash, header, nonce)
+        except (ValueError, TypeError):
+            return "malformed share"
+        if mix != mix_digest.lower():
+            return "wrong mix digest"
+        if int(result, 16) > int(boundary, 16):
+            return "low difficulty"
+        return None
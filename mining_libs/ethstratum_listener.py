@@ -0,0 +1,166 @@
+import binascii
+import os
+from collections import OrderedDict
+
+from twisted.internet import threads
+
+from stratum.pubsub import Pubsub, Subscription
+from stratum import custom_exceptions
+from stratum import settings
+from stratum_listener import EthProxyService, StratumListenerFactory
+import ethash
+import stratum.logger
+log = stratum.logger.get_logger('proxy')
+
+# Boundary of difficulty 1 share in EthereumStratum/1.0.0 (2^32 hashes)
+DIFF1_TARGET = 0x00000000ffff0000000000000000000000000000000000000000000000000000
+
+class ExtranonceAllocator(object):
+    '''Hands out disjoint nonce prefixes, so every miner searches its own part of nonce space'''
+    def __init__(self, size):
+        self.size = size # in bytes
+        self.limit = 1 << (8*size)
+        self.counter = 0
+        self.used = set()
+
+    def allocate(self):
+        if len(self.used) >= self.limit:
+            raise custom_exceptions.ServiceException("No free extranonce, too many miners connected")
+        while self.counter in self.used:
+            self.counter = (self.counter+1) % self.limit
+        self.used.add(self.counter)
+        extranonce = '%0*x' % (self.size*2, self.counter)
+        self.counter = (self.counter+1) % self.limit
+        return extranonce
+
+    def release(self, extranonce):
+        self.used.discard(int(extranonce, 16))
+
+class NotifySubscription(Subscription):
+    '''Sends mining.set_difficulty (on change) and mining.notify to EthereumStratum miners'''
+    event = 'mining.notify'
+
+    def emit_single(self, *args, **kwargs):
+        conn = self.connection_ref()
+        if conn == None or conn.transport == None:
+            # Connection is closed
+            return
+
+        difficulty = conn.factory.difficulty
+        if conn.session.get('difficulty') != difficulty:
+            conn.session['difficulty'] = difficulty
+            conn.writeJsonRequest('mining.set_difficulty', [difficulty], '', is_notification=True)
+        Subscription.emit_single(self, *args, **kwargs)
+
+    def process(self, job_id, seedhash, header):
+        return [job_id, seedhash[2:], header[2:], True]
+
+    def after_subscribe(self, result):
+        # Send current job right after authorize response
+        factory = self.connection_ref().factory
+        if factory.current_job_id:
+            params = factory.recent_jobs[factory.current_job_id]
+            self.emit_single(factory.current_job_id, params[1], params[0])
+        return result
+
+class EthereumStratumService(EthProxyService):
+    '''Handles miners speaking EthereumStratum/1.0.0 (NiceHash) dialect.
+    Other methods (eth_submitHashrate, ...) are handled by EthProxyService.'''
+
+    def handle_event(self, method, params, connection_ref):
+        factory = connection_ref.factory
+        session = connection_ref.session
+
+        if method == 'mining.subscribe':
+            if not session.get('extranonce'):
+                session['extranonce'] = factory.extranonces.allocate()
+                connection_ref.on_disconnect.addCallback(lambda conn: factory.extranonces.release(session['extranonce']))
+            return [["mining.notify", binascii.hexlify(os.urandom(8)), "EthereumStratum/1.0.0"], session['extranonce']]
+
+        elif method == 'mining.extranonce.subscribe':
+            return True
+
+        elif method == 'mining.authorize':
+            if not session.get('extranonce'):
+                raise custom_exceptions.UnauthorizedException("Call mining.subscribe first")
+            # Wallet is configured on proxy, login is used only for rig name
+            if params and not session.get('worker') and '.' in str(params[0]):
+                session['worker'] = str(params[0]).split('.', 1)[1][:32]
+            if not session.get('subscriptions'):
+                Pubsub.subscribe(connection_ref, NotifySubscription())
+            return True
+
+        elif method == 'mining.submit':
+            # params: [login, job_id, nonce without extranonce prefix]
+            extranonce = session.get('extranonce')
+            if not extranonce or not params or len(params) < 3:
+                raise custom_exceptions.ServiceException("Invalid mining.submit")
+            nonce = extranonce + str(params[2]).lower().replace('0x', '', 1)
+            try:
+                int(nonce, 16)
+            except ValueError:
+                raise custom_exceptions.ServiceException("Invalid nonce")
+            if len(nonce) != 16:
+                raise custom_exceptions.ServiceException("Invalid nonce length")
+
+            job = factory.recent_jobs.get(params[1])
+            if not job:
+                log.info("Stale mining.submit of job %s by %s" % (params[1], self.get_worker_name(connection_ref)))
+                return False
+
+            (header, seedhash, boundary) = (job[0], job[1], job[2])
+            worker_name = self.get_worker_name(connection_ref)
+
+            def submit(hashimoto):
+                if settings.VERIFY_SHARES and int(hashimoto[1], 16) > int(boundary, 16):
+                    factory.job_registry.invalid_shares += 1
+                    log.warning("INVALID mining.submit %s by %s: low difficulty" % (nonce, worker_name))
+                    raise custom_exceptions.RejectedShareException("Low difficulty share")
+                return factory.job_registry.submit('eth_submitWork', ['0x'+nonce, header, hashimoto[0]], worker_name, verified=True)
+
+            # Pool wants mix digest which miner does not send in this dialect
+            d = threads.deferToThread(factory.ethash.hashimoto, seedhash, header, nonce)
+            d.addCallback(submit)
+            return d
+
+        return EthProxyService.handle_event(self, method, params, connection_ref)
+
+class EthStratumListenerFactory(StratumListenerFactory):
+    '''Miner-facing EthereumStratum/1.0.0 listener with per-miner extranonce'''
+    def __init__(self, job_registry, debug=False, event_handler=EthereumStratumService):
+        self.extranonces = ExtranonceAllocator(settings.ETHSTRATUM_EXTRANONCE_SIZE)
+        # Share light caches with share verification of JobRegistry
+        self.ethash = job_registry.ethash or ethash.EthashLight(settings.ETHASH_CACHE_DIR)
+        self.recent_jobs = OrderedDict() # job_id -> job params
+        self.current_job_id = None
+        self.job_counter = 0
+        self.difficulty = 1.0
+        StratumListenerFactory.__init__(self, job_registry, debug=debug, event_handler=event_handler)
+        if job_registry.jobs:
+            self.add_job(job_registry.jobs.params)
+
+    def add_job(self, params):
+        if len(params) < 3:
+            return
+        self.job_counter += 1
+        self.current_job_id = "%x" % self.job_counter
+        self.recent_jobs[self.current_job_id] = params
+        while len(self.recent_jobs) > 8:
+            self.recent_jobs.popitem(last=False)
+        self.difficulty = float(DIFF1_TARGET) / int(params[2], 16)
+
+        if len(self.recent_jobs) == 1 or self.recent_jobs.values()[-2][1] != params[1]:
+            # Prepare ethash cache for new epoch before first share arrives
+            d = threads.deferToThread(self.ethash.get_cache, params[1])
+            d.addErrback(self.on_cache_error, params[1])
+
+    def on_cache_error(self, failure, seedhash):
+        '''Cache is generated again by first mining.submit of the epoch'''
+        log.error("Cannot prepare ethash cache for seedhash %s: %s" % (seedhash, failure.getErrorMessage()))
+
+    def on_block(self, result):
+        self.add_job(self.job_registry.jobs.params)
+        NotifySubscription.emit(self.current_job_id, self.job_registry.jobs.params[1], self.job_registry.jobs.params[0])
+        # Hook to on_block again
+        self.job_registry.on_block.addCallback(self.on_block)
+        return result
@@ -1,13 +1,48 @@
-import json
 import time
 
-from twisted.internet import defer, threads
+from twisted.internet import defer, reactor
 from twisted.web.resource import Resource
 from twisted.web.server import NOT_DONE_YET
 
+from stratum import settings
+from stratum import custom_exceptions
+from stratum import codec
+from stratum import metrics
+from workers import worker_name_from_ip
 import stratum.logger
 log = stratum.logger.get_logger('proxy')
 
+GETWORK_REQUESTS = metrics.Counter('ethproxy_getwork_requests_total', 'eth_getWork requests of getwork miners')
+
+class LongPoll(object):
+    '''eth_getWork request parked until JobRegistry installs new job or timeout expires'''
+    def __init__(self, job_registry, request, msg_id):
+        self.job_registry = job_registry
+        self.request = request
+        self.msg_id = msg_id
+        self.timer = reactor.callLater(settings.GETWORK_LONGPOLL_TIMEOUT, self.respond)
+        job_registry.on_block.addCallback(self.respond)
+        request.notifyFinish().addErrback(self.cancel)
+
+    def respond(self, result=None):
+        if self.request != None:
+            request = self.request
+            self.request = None
+            if self.timer.active():
+                self.timer.cancel()
+            try:
+                request.write(self.job_registry.getwork_response(self.msg_id)+'\n')
+                request.finish()
+            except Exception:
+                pass
+        return result
+
+    def cancel(self, failure):
+        '''Miner closed connection before new job arrived'''
+        self.request = None
+        if self.timer.active():
+            self.timer.cancel()
+
 class Root(Resource):
     isLeaf = True
 
@@ -15,78 +50,155 @@ class Root(Resource):
         Resource.__init__(self)
         self.job_registry = job_registry
         self.isWorkerID = enable_worker_id
-        self.submitHashrates = {}
         self.getWorkCacheTimeout = {"work":"","time":0}
+        self.register_metrics()
+
+    def register_metrics(self):
+        '''Proxy state read on every /metrics scrape'''
+        jr = self.job_registry
+        metrics.Gauge('ethproxy_shares_fresh_total', 'Shares of current job', lambda: jr.fresh_shares, 'counter')
+        metrics.Gauge('ethproxy_shares_late_total', 'Shares of previous jobs within STALE_SHARE_WINDOW', lambda: jr.late_shares, 'counter')
+        metrics.Gauge('ethproxy_shares_stale_total', 'Stale shares refused by proxy', lambda: jr.stale_shares, 'counter')
+        metrics.Gauge('ethproxy_shares_duplicate_total', 'Duplicate shares refused by proxy', lambda: jr.share_index.duplicates, 'counter')
+        metrics.Gauge('ethproxy_shares_invalid_total', 'Invalid shares refused by proxy', lambda: jr.invalid_shares, 'counter')
+        metrics.Gauge('ethproxy_submit_queue_depth', 'Shares waiting for upstream write', lambda: len(jr.submit_queue))
+        metrics.Gauge('ethproxy_submit_queue_dropped_total', 'Shares refused because submit queue was full', lambda: jr.submit_queue.dropped, 'counter')
+        metrics.Gauge('ethproxy_replay_queue_depth', 'Shares waiting for their pool to come back', lambda: len(jr.replay_queue))
+        metrics.Gauge('ethproxy_replay_delivered_total', 'Shares sent after their pool came back', lambda: jr.replay_queue.delivered, 'counter')
+        metrics.Gauge('ethproxy_replay_expired_total', 'Shares which got old or stale while waiting for their pool', lambda: jr.replay_queue.expired, 'counter')
+        metrics.Gauge('ethproxy_replay_dropped_total', 'Shares dropped because replay queue was full', lambda: jr.replay_queue.dropped, 'counter')
+        metrics.Gauge('ethproxy_workers', 'Workers in registry', lambda: len(jr.workers))
+        metrics.Gauge('ethproxy_hashrate', 'Reported hashrate of active workers, H/s', lambda: int(jr.hashrates.get_total()))
+        metrics.Gauge('ethproxy_job_age_seconds', 'Age of current job', lambda: time.time()-jr.jobs.time if jr.jobs else 0.0)
+        metrics.Gauge('ethproxy_pools_connected', 'Connected pool servers', jr.count_connected_pools)
 
     def json_response(self, msg_id, result):
-        resp = json.dumps({'id': msg_id, 'jsonrpc': '2.0', 'result': result})
+        resp = codec.dumps({'id': msg_id, 'jsonrpc': '2.0', 'result': result})
         return resp
 
     def json_error(self, msg_id, message):
-        resp = json.dumps({'id': msg_id, 'jsonrpc': '2.0', 'result': False, 'error': message})
+        resp = codec.dumps({'id': msg_id, 'jsonrpc': '2.0', 'result': False, 'error': message})
         return resp
 
+    def get_worker_name(self, request):
+        if not self.isWorkerID:
+            return ''
+        worker_name = request.uri[1:15].split("/")[0]
+        if not worker_name:
+            worker_name = worker_name_from_ip(request.getClientIP())
+        return worker_name
+
     def render_POST(self, request):
         request.setHeader('content-type', 'application/json')
-        data = json.loads(request.content.read())
+        data = codec.loads(request.content.read())
 
-        if not self.job_registry.jobs:
-            log.warning('Proxy is waiting for a job...')
-            request.write(self.json_error(data.get('id', 0), "Proxy is waiting for a job...")+'\n')
+        if isinstance(data, list):
+            # JSON-RPC batch, whole rig is served in one round trip
+            if data:
+                response = '[%s]' % ','.join([ self.handle_rpc(request, item, batch=True) for item in data ])
+            else:
+                response = self.json_error(None, "Empty batch")
+        else:
+            response = self.handle_rpc(request, data)
+            if response == None:
+                # Request is parked by LongPoll
+                return NOT_DONE_YET
+
+        try:
+            request.write(response+'\n')
             request.finish()
             return NOT_DONE_YET
+        except Exception:
+            return
+
+    def handle_rpc(self, request, data, batch=False):
+        '''Returns serialized response for one JSON-RPC request, or None when request was parked for long polling'''
+        if not isinstance(data, dict):
+            return self.json_error(None, "Invalid request")
+
+        if not self.job_registry.jobs:
+            log.warning('Proxy is waiting for a job...')
+            return self.json_error(data.get('id', 0), "Proxy is waiting for a job...")
 
         if not data.has_key('method'):
-            response = self.json_error(data.get('id'), "Need methods")+'\n'
+            response = self.json_error(data.get('id'), "Need methods")
         elif data['method'] == 'eth_getWork':
+            GETWORK_REQUESTS.inc()
             if self.getWorkCacheTimeout["work"]==self.job_registry.jobs.params[0] and int(time.time())-self.getWorkCacheTimeout["time"]>=self.job_registry.coinTimeout:
                 log.warning('Job timeout. Proxy is waiting for an updated job. Please restart proxy!')
                 response = self.json_error(data.get('id', 0), "Job timeout. Proxy is waiting for an updated job...")
             else:
                 if self.getWorkCacheTimeout["work"]!=self.job_registry.jobs.params[0]:
                     self.getWorkCacheTimeout = {"work":self.job_registry.jobs.params[0],"time":int(time.time())}
-                response = self.json_response(data.get('id', 0), self.job_registry.jobs.params)
+                params = data.get('params')
+                if settings.GETWORK_LONGPOLL and not batch and isinstance(params, list) and params and params[0]==self.job_registry.jobs.params[0]:
+                    # Miner already has current job, answer once new one is installed
+                    LongPoll(self.job_registry, request, data.get('id', 0))
+                    return None
+                self.job_registry.workers.get(self.get_worker_name(request)).last_getwork = time.time()
+                response = self.job_registry.getwork_response(data.get('id', 0))
         elif data['method'] == 'eth_submitWork' or data['method'] == 'eth_submitHashrate':
-            if self.isWorkerID:
-                worker_name = request.uri[1:15].split("/")[0]
-                if not worker_name:
-                    ip_temp = request.getClientIP().split('.')
-                    worker_name = str( int(ip_temp[0])*16777216 + int(ip_temp[1])*65536 + int(ip_temp[2])*256 + int(ip_temp[3]) )
-            else:
-                worker_name = ''
-
-            if data['method'] == 'eth_submitHashrate':
-                if worker_name and (not self.submitHashrates.has_key(worker_name) or int(time.time())-self.submitHashrates[worker_name]>=60):
-                    self.submitHashrates[worker_name] = int(time.time())
-                    log.info('Hashrate for %s is %s MHs' % (worker_name,int(data['params'][0],16)/1000000.0 ) )
-                    threads.deferToThread(self.job_registry.submit, data['method'], data['params'], worker_name)
-            elif data['method'] == 'eth_submitWork':
-                threads.deferToThread(self.job_registry.submit, data['method'], data['params'], worker_name)
+            worker_name = self.get_worker_name(request)
+            params = data.get('params')
+            if not isinstance(params, list):
+                return self.json_error(data.get('id', 0), "Invalid params")
+
+            try:
+                if data['method'] == 'eth_submitHashrate':
+                    self.job_registry.hashrates.update(worker_name, params)
+                elif data['method'] == 'eth_submitWork':
+                    self.job_registry.submit(data['method'], params, worker_name)
+            except custom_exceptions.ServiceException as e:
+                return self.json_error(data.get('id', 0), str(e))
             response = self.json_response(data.get('id', 0), True)
         else:
             response = self.json_error(data.get('id'), "Unsupported method '%s'" % data['method'])
 
-        try:
-            request.write(response+'\n')
-            request.finish()
-            return NOT_DONE_YET
-        except Exception:
-            return
+        return response
 
     def render_GET(self, request):
+        (code, content_type, body) = self.get_page(request.path)
+        request.setResponseCode(code)
+        request.setHeader('content-type', content_type)
+        return body
+
+    def get_page(self, path):
+        '''Returns (response code, content type, body) of status page, worker processes ask master for it'''
+        if path == '/hashrate':
+            return (200, 'application/json', codec.dumps({'total': int(self.job_registry.hashrates.get_total()), 'workers': self.job_registry.hashrates.get_stats()}))
+        if path == '/workers':
+            return (200, 'application/json', codec.dumps(self.job_registry.workers.get_stats()))
+        if path == '/metrics':
+            return (200, 'text/plain; version=0.0.4', metrics.render())
+        if path == '/health':
+            # For load balancers, proxy is healthy when it has fresh job and connected pool
+            if not self.job_registry.jobs or time.time()-self.job_registry.jobs.time > self.job_registry.coinTimeout:
+                return (503, 'text/plain', "NO JOB\n")
+            if not self.job_registry.count_connected_pools():
+                return (503, 'text/plain', "NO POOL\n")
+            return (200, 'text/plain', "OK\n")
+
         ret_text = "Ethereum stratum proxy<br>"
         if self.job_registry and self.job_registry.jobs and self.job_registry.jobs.params:
             ret_text += "DAG-file: %s<br><br>" % str(self.job_registry.jobs.params[1][2:18])
-        if self.job_registry.f:
-            connected = "connected" if (hasattr(self.job_registry.f, "is_connected") and self.job_registry.f.is_connected) else "disconnected"
-            ret_text += "Main server %s:%s (%s) %s<br>" % (self.job_registry.f.main_host[0], self.job_registry.f.main_host[1], self.job_registry.f.remote_ip, connected)
-        if self.job_registry.f1:
-            connected = "connected" if (hasattr(self.job_registry.f1, "is_connected") and self.job_registry.f1.is_connected) else "disconnected"
-            ret_text += "Failover server1 %s:%s (%s) %s<br>" % (self.job_registry.f1.main_host[0], self.job_registry.f1.main_host[1], self.job_registry.f1.remote_ip, connected)
-        if self.job_registry.f2:
-            connected = "connected" if (hasattr(self.job_registry.f2, "is_connected") and self.job_registry.f2.is_connected) else "disconnected"
-            ret_text += "Failover server2 %s:%s (%s) %s<br>" % (self.job_registry.f2.main_host[0], self.job_registry.f2.main_host[1], self.job_registry.f2.remote_ip, connected)
-        if self.job_registry.f3:
-            connected = "connected" if (hasattr(self.job_registry.f3, "is_connected") and self.job_registry.f3.is_connected) else "disconnected"
-            ret_text += "Failover server3 %s:%s (%s) %s<br>" % (self.job_registry.f3.main_host[0], self.job_registry.f3.main_host[1], self.job_registry.f3.remote_ip, connected)
-        return ret_text
+        for f in self.job_registry.pools:
+            connected = "connected" if f.is_connected else "disconnected"
+            name = "Failover server%d" % f.pool_number if f.pool_number else "Main server"
+            health = self.job_registry.health.get(f.pool_number)
+            if f.is_connected and health.state != 'up':
+                connected += " (%s: %s)" % (health.state, health.reason)
+            latency = self.job_registry.latency.get(f.pool_number)
+            if latency.rtt != None:
+                connected += ", ping %.1fms" % (latency.rtt * 1000)
+            if latency.job_lag != None:
+                connected += ", job lag %.1fms" % (latency.job_lag * 1000)
+            if f.rpc_timeouts.value:
+                connected += ", %d requests timed out" % f.rpc_timeouts.value
+            if f is self.job_registry.active_pool:
+                connected += ", active"
+            ret_text += "%s %s:%s (%s) %s<br>" % (name, f.main_host[0], f.main_host[1], f.remote_ip, connected)
+        ret_text += "<br>Shares: %d fresh, %d late, %d stale, %d duplicate, %d invalid<br>" % (self.job_registry.fresh_shares, self.job_registry.late_shares,
+                    self.job_registry.stale_shares, self.job_registry.share_index.duplicates, self.job_registry.invalid_shares)
+        ret_text += "Submit queue: %(depth)d waiting (max %(max_depth)d), %(sent)d sent, %(dropped)d refused, upstream write after %(wait_avg_ms).1fms avg, %(wait_max_ms).1fms max<br>" % self.job_registry.submit_queue.get_stats()
+        ret_text += "Replay queue: %(depth)d waiting for pool, %(delivered)d delivered, %(expired)d expired, %(dropped)d dropped<br>" % self.job_registry.replay_queue.get_stats()
+        return (200, 'text/html', ret_text)
@@ -0,0 +1,81 @@
+import hashlib
+import math
+import time
+
+from twisted.internet import task
+
+from stratum import settings
+from stratum import custom_exceptions
+import stratum.logger
+log = stratum.logger.get_logger('proxy')
+
+class HashrateTable(object):
+    '''Rolling hashrate averages of workers, stored in their WorkerRegistry records.
+    Upstream gets one coalesced eth_submitHashrate per interval, per worker or as a farm total.'''
+
+    def __init__(self, workers, submit, interval, mode='worker', window=600, max_idle=600):
+        self.workers = workers # WorkerRegistry
+        self.submit = submit # JobRegistry.submit
+        self.interval = interval
+        self.mode = mode
+        self.window = window # Time constant of rolling average in seconds
+        self.max_idle = max_idle # Worker's hashrate is ignored after this many seconds of silence
+        self.farm_id = '0x' + hashlib.sha256(settings.WALLET).hexdigest()
+        self.loop = task.LoopingCall(self.report)
+
+    def start(self):
+        self.loop.start(self.interval, now=False)
+
+    def update(self, worker_name, params):
+        '''Store eth_submitHashrate params [hashrate, miner id] reported by worker'''
+        try:
+            (hashrate, miner_id) = (int(params[0], 16), params[1])
+        except (ValueError, TypeError, IndexError):
+            raise custom_exceptions.ServiceException("Invalid eth_submitHashrate params")
+
+        now = time.time()
+        worker = self.workers.get(worker_name)
+        if not worker.hashrate_time:
+            worker.hashrate_average = float(hashrate)
+        else:
+            alpha = 1.0 - math.exp(-max(now-worker.hashrate_time, 0) / self.window)
+            worker.hashrate_average += alpha * (hashrate-worker.hashrate_average)
+        worker.hashrate = hashrate
+        worker.miner_id = miner_id
+        worker.hashrate_time = now
+
+    def get_active(self):
+        '''Workers which reported hashrate recently'''
+        now = time.time()
+        return [ worker for worker in self.workers if worker.hashrate_time and now-worker.hashrate_time <= self.max_idle ]
+
+    def get_total(self):
+        return sum([ worker.hashrate_average for worker in self.get_active() ])
+
+    def report(self):
+        active = self.get_active()
+        if not active:
+            return
+
+        if self.mode == 'farm':
+            total = sum([ worker.hashrate_average for worker in active ])
+            log.info('Hashrate of farm (%d workers) is %s MHs' % (len(active), total/1000000.0))
+            try:
+                self.submit('eth_submitHashrate', ['0x%x' % int(total), self.farm_id], '')
+            except custom_exceptions.ServiceException as e:
+                log.warning("Hashrate report not sent: %s" % e)
+            return
+
+        for worker in active:
+            if worker.name:
+                log.info('Hashrate for %s is %s MHs' % (worker.name, worker.hashrate_average/1000000.0))
+                try:
+                    self.submit('eth_submitHashrate', ['0x%x' % int(worker.hashrate_average), worker.miner_id], worker.name)
+                except custom_exceptions.ServiceException as e:
+                    # Other workers are still reported
+                    log.warning("Hashrate report of %s not sent: %s" % (worker.name, e))
+
+    def get_stats(self):
+        now = time.time()
+        return dict([ (worker.name, {'hashrate': worker.hashrate, 'average': int(worker.hashrate_average), 'last_seen': int(now-worker.hashrate_time)})
+                      for worker in self.get_active() ])
@@ -1,12 +1,34 @@
-from twisted.internet import defer
+import time
+from collections import OrderedDict
+
+from twisted.internet import defer, threads
+from twisted.python.failure import Failure
 
 from stratum import settings
+from stratum import custom_exceptions
+from stratum import codec
+from stratum import metrics
+from submit_queue import SubmitQueue
+from share_index import ShareIndex
+from hashrate import HashrateTable
+from workers import WorkerRegistry
+from pool_latency import LatencyTable
+from pool_health import HealthMonitor
+from replay_queue import ReplayQueue
+import journal
+import ethash
 import stratum.logger
 log = stratum.logger.get_logger('proxy')
 
+JOB_INTERVAL = metrics.Histogram('ethproxy_job_interval_seconds', 'Time between new jobs',
+                                 (1, 2, 5, 10, 15, 20, 30, 45, 60, 120, 300))
+
 class Job(object):
     def __init__(self):
         self.params = ''
+        self.pool = None # Pool number which issued the job, 0 is main pool
+        self.time = time.time() # When job was received
+        self.expired_time = None # When job was replaced by newer one
 
     @classmethod
     def build_from_pool(cls, getWorkParams):
@@ -15,13 +37,31 @@ class Job(object):
         job.params = getWorkParams
         return job
 
+def get_pool_name(pool_number):
+    '''MAIN for main pool, FAILOVERn for failovers'''
+    return "FAILOVER%d" % pool_number if pool_number else "MAIN"
+
 class JobRegistry(object):
-    def __init__(self, f, f1, f2, f3):
-        self.f = f
-        self.f1 = f1
-        self.f2 = f2
-        self.f3 = f3
+    def __init__(self, pools):
+        # Factories of main pool and failovers in priority order, factory.pool_number is index here
+        self.pools = pools
+        # Jobs are taken from active pool and shares go to it, see update_active_pool()
+        self.active_pool = None
+        # Smoothed ping RTT and job lag of pools, used by POOL_SELECTION = 'latency'
+        self.latency = LatencyTable(pools, settings.POOL_SWITCH_MARGIN / 1000.0, settings.POOL_SWITCH_DELAY)
+        # Health state of pools driven by heartbeats, jobs and disconnects, see HealthMonitor.start()
+        self.health = HealthMonitor(pools, settings.POOL_FAILOVER_TIMEOUT / 1000.0, settings.POOL_JOB_TIMEOUT, self.update_active_pool)
         self.jobs = None
+        # Last job of every pool and when the pool sent it last time, indexed by pool_number.
+        # Job of newly active pool is installed from here, see install_cached_job()
+        self.pool_jobs = [ None for _ in pools ]
+        # Pre-serialized eth_getWork response for current job, see getwork_response()
+        self.getwork_cache = (None, None)
+        # Ring of last RECENT_JOBS installed jobs by lowercase header, oldest first
+        self.recent_jobs = OrderedDict()
+        self.fresh_shares = 0
+        self.late_shares = 0
+        self.stale_shares = 0
         # stop mining after 6 minutes if internet disconnected
         if settings.COIN=="ETH":
             self.coinTimeout = 360
@@ -29,76 +69,269 @@ class JobRegistry(object):
             self.coinTimeout = 900 # For expanse 15 minutes waiting for new job
         # Hook for LP broadcasts
         self.on_block = defer.Deferred()
+        # Shares and hashrates waiting for upstream write
+        self.submit_queue = SubmitQueue(self.submit_upstream, settings.SUBMIT_QUEUE_SIZE)
+        # Shares whose pool was down, sent once it's back, see flush_replay_queue()
+        self.replay_queue = ReplayQueue(settings.REPLAY_QUEUE_SIZE, settings.REPLAY_QUEUE_MAX_AGE)
+        # Performance records of workers, shared with listeners
+        self.workers = WorkerRegistry(settings.MAX_WORKERS)
+        # Hashrates of workers, reported upstream once per interval, see HashrateTable.start()
+        self.hashrates = HashrateTable(self.workers, self.submit, settings.HASHRATE_REPORT_INTERVAL, settings.HASHRATE_REPORT_MODE)
+        # Durable record of share verdicts, see journal.py
+        self.journal = journal.ShareJournal(settings.JOURNAL_DIR) if settings.SHARE_JOURNAL else None
+        # Shares of recent jobs, duplicates are answered locally
+        self.share_index = ShareIndex(settings.DUPLICATE_SHARE_WINDOW)
+        # Local verification of shares, invalid ones never reach the pool
+        self.ethash = None
+        self.invalid_shares = 0
+        if settings.VERIFY_SHARES:
+            if ethash.pyethash:
+                self.ethash = ethash.EthashLight(settings.ETHASH_CACHE_DIR)
+            else:
+                log.error("VERIFY_SHARES needs pyethash package, shares will not be verified")
+
+    def count_connected_pools(self):
+        return len([ f for f in self.pools if f.is_connected ])
+
+    def update_active_pool(self):
+        '''Call when pool gets connected or disconnected, and periodically with latency policy.
+        Policy 'priority' takes first connected pool, 'latency' the fastest one.'''
+        connected = [ f for f in self.pools if self.health.is_usable(f.pool_number) ]
+        # Suspect pools are used only when no healthy one is left
+        candidates = [ f for f in connected if self.health.is_healthy(f.pool_number) ] or connected
+        if settings.POOL_SELECTION == 'latency':
+            active = self.latency.select(self.active_pool, candidates)
+        else:
+            active = candidates[0] if candidates else None
+        if active is not self.active_pool:
+            if active:
+                log.info("Active pool is %s %s:%d" % ((get_pool_name(active.pool_number),) + active.main_host))
+            else:
+                log.warning("All pools are down")
+            self.active_pool = active
+            if active:
+                self.install_cached_job(active)
+
+    def install_cached_job(self, pool):
+        '''Miners get last job of newly active pool at once, if the pool sent it recently'''
+        cached = self.pool_jobs[pool.pool_number]
+        if not cached or cached[0] is self.jobs:
+            return
+        (job, last_seen) = cached
+        if time.time()-last_seen > settings.WARM_JOB_MAX_AGE:
+            return
+        log.info("NEW_JOB %s_POOL from cache" % get_pool_name(pool.pool_number))
+        self.install_job(job)
 
     def replace_job(self, newjob, connection_ref):
-        is_main_pool = True
-        if self.f and hasattr(self.f, "remote_ip"):
-            is_main_pool = connection_ref._get_ip() == self.f.remote_ip
-
-        pool_number = 0
-        is_failover_pool1 = False
-        if self.f1 and hasattr(self.f1, "remote_ip"):
-            is_failover_pool1 = connection_ref._get_ip() == self.f1.remote_ip
-            if is_failover_pool1:
-                pool_number = 1
-
-        is_failover_pool2 = False
-        if self.f2 and hasattr(self.f2, "remote_ip"):
-            is_failover_pool2 = connection_ref._get_ip() == self.f2.remote_ip
-            if is_failover_pool2:
-                pool_number = 2
-
-        is_failover_pool3 = False
-        if self.f3 and hasattr(self.f3, "remote_ip"):
-            is_failover_pool3 = connection_ref._get_ip() == self.f3.remote_ip
-            if is_failover_pool3:
-                pool_number = 3
-
-        if is_main_pool:
-            log_text = "NEW_JOB MAIN_POOL"
+        # Connection knows its pool, no need to search for it
+        pool = connection_ref.factory
+        self.latency.add_job(pool.pool_number, newjob.params[0])
+        self.health.on_job(pool.pool_number, newjob.params[0])
+        if pool.pool_number:
+            log_text = "NEW_JOB FAILOVER_POOL%d" % pool.pool_number
         else:
-            log_text = "NEW_JOB FAILOVER_POOL%s" % pool_number
+            log_text = "NEW_JOB MAIN_POOL"
+
+        # Keep job of every pool warm, the same object when pool repeats it
+        newjob.pool = pool.pool_number
+        cached = self.pool_jobs[pool.pool_number]
+        if cached and cached[0].params[0] == newjob.params[0]:
+            newjob = cached[0]
+        self.pool_jobs[pool.pool_number] = (newjob, time.time())
 
-        if (self.f and self.f.is_connected and is_main_pool) or \
-            (not self.f.is_connected and not is_main_pool and self.f1 and self.f1.is_connected and is_failover_pool1) or \
-            (not self.f.is_connected and not is_main_pool and self.f2 and self.f2.is_connected and is_failover_pool2 and not self.f1.is_connected) or \
-            (not self.f.is_connected and not is_main_pool and self.f3 and self.f3.is_connected and is_failover_pool3 and not self.f1.is_connected and not self.f2.is_connected):
+        if pool is self.active_pool:
             if self.jobs and self.jobs.params and self.jobs.params[0]==newjob.params[0]:
                 return
             if stratum.logger.settings.DEBUG:
                 log.debug("%s %s" % (log_text, newjob.params))
             else:
                 log.info(log_text)
-            self.jobs = newjob
-            # Force miners to reload jobs
-            on_block = self.on_block
-            self.on_block = defer.Deferred()
-            on_block.callback(True)
+            self.install_job(newjob)
         elif stratum.logger.settings.DEBUG:
             log.debug("%s NOT_USED %s" % (log_text, newjob.params))
 
-    def submit(self, method, params, worker_name):
+    def install_job(self, job):
+        '''Make job current, serialize it once for getwork clients and wake up listeners'''
+        if self.jobs:
+            self.jobs.expired_time = time.time()
+            if job.time > self.jobs.time:
+                # Cached job of other pool may be older
+                JOB_INTERVAL.observe(job.time - self.jobs.time)
+        self.jobs = job
+        self.recent_jobs[job.params[0].lower()] = job
+        while len(self.recent_jobs) > settings.RECENT_JOBS:
+            self.recent_jobs.popitem(last=False)
+        self.getwork_cache = (job, codec.dumps({'jsonrpc': '2.0', 'result': job.params})[1:])
+        # Force miners to reload jobs
+        on_block = self.on_block
+        self.on_block = defer.Deferred()
+        on_block.callback(True)
+
+    def getwork_response(self, msg_id):
+        '''Return serialized eth_getWork response for current job, only msg_id is spliced in'''
+        job, tail = self.getwork_cache
+        if job is not self.jobs:
+            # Job was set without install_job(), refresh the cache
+            tail = codec.dumps({'jsonrpc': '2.0', 'result': self.jobs.params})[1:]
+            self.getwork_cache = (self.jobs, tail)
+        if msg_id.__class__ is int:
+            return '{"id": %d, %s' % (msg_id, tail)
+        return '{"id": %s, %s' % (codec.dumps(msg_id), tail)
+
+    def get_job(self, header):
+        '''Recent job with given header or None'''
+        return self.recent_jobs.get(str(header).lower())
+
+    def submit(self, method, params, worker_name, verified=False):
+        '''Queue share or hashrate for upstream write.
+        Raises RejectedShareException when share is stale, duplicate or queue is full.
+        With VERIFY_SHARES, shares are checked in thread first.'''
+        if method == 'eth_submitWork':
+            worker = self.workers.get(worker_name)
+            worker.last_submit = time.time()
+            if not isinstance(params, list) or len(params) < 3:
+                worker.rejected += 1
+                raise custom_exceptions.RejectedShareException("Invalid eth_submitWork params")
+
+            job = self.get_job(params[1])
+            if not job or (job is not self.jobs and time.time()-job.expired_time > settings.STALE_SHARE_WINDOW):
+                # Pool would reject it anyway
+                self.stale_shares += 1
+                worker.rejected += 1
+                self.record_share(params, worker_name, journal.STALE)
+                log.warning("STALE eth_submitWork %s by %s" % (params[0], worker_name))
+                raise custom_exceptions.RejectedShareException("Stale share")
+
+            if not self.share_index.add(params[0], params[1], params[2]):
+                worker.rejected += 1
+                self.record_share(params, worker_name, journal.DUPLICATE)
+                log.warning("DUPLICATE eth_submitWork %s by %s" % (params[0], worker_name))
+                raise custom_exceptions.RejectedShareException("Duplicate share")
+
+            # Counted only once share passed the checks
+            if job is self.jobs:
+                self.fresh_shares += 1
+            else:
+                self.late_shares += 1
+
+            if self.ethash and not verified:
+                (seedhash, boundary) = (job.params[1], job.params[2])
+                d = threads.deferToThread(self.ethash.verify, seedhash, boundary, params[0], params[1], params[2])
+                d.addCallbacks(self.on_verified, self.on_verify_error, callbackArgs=(method, params, worker_name),
+                               errbackArgs=(method, params, worker_name))
+                return True
+
+        if not self.submit_queue.put(method, params, worker_name):
+            if method == 'eth_submitWork':
+                # Refused share may come again, it isn't a duplicate then
+                self.share_index.remove(params[0], params[1], params[2])
+            raise custom_exceptions.RejectedShareException("Proxy is busy, submit queue is full")
+        return True
+
+    def on_verified(self, reason, method, params, worker_name):
+        if reason:
+            self.invalid_shares += 1
+            self.workers.get(worker_name).rejected += 1
+            self.record_share(params, worker_name, journal.INVALID)
+            log.warning("INVALID eth_submitWork %s by %s: %s" % (params[0], worker_name, reason))
+        elif not self.submit_queue.put(method, params, worker_name):
+            # Miner was already answered, share is lost
+            self.workers.get(worker_name).rejected += 1
+            self.record_share(params, worker_name, journal.LOST)
+            log.warning("NO_SUBMIT_QUEUE_FULL eth_submitWork %s by %s" % (params[0], worker_name))
+
+    def on_verify_error(self, failure, method, params, worker_name):
+        '''Verification itself failed (cache generation, memory), pool decides about the share'''
+        log.error("Cannot verify eth_submitWork %s by %s, submitting it unverified: %s" % (params[0], worker_name, failure.getErrorMessage()))
+        self.on_verified(None, method, params, worker_name)
+
+    def submit_upstream(self, method, params, worker_name):
         log_text = ""
         if settings.DEBUG:
             log_text = "%s by %s %s" % (method, worker_name, params)
         elif method=="eth_submitWork":
             log_text = "eth_submitWork %s by %s" % (params[0], worker_name)
-        if self.f.is_connected:
-            if log_text:
-                log.info( "MAIN %s" % log_text )
-            self.f.rpc(method, params, worker_name)
-        elif self.f1 and self.f1.is_connected:
-            if log_text:
-                log.info( "FAILOVER1 %s" % log_text )
-            self.f1.rpc(method, params, worker_name)
-        elif self.f2 and self.f2.is_connected:
-            if log_text:
-                log.info( "FAILOVER2 %s" % log_text )
-            self.f2.rpc(method, params, worker_name)
-        elif self.f3 and self.f3.is_connected:
-            if log_text:
-                log.info( "FAILOVER3 %s" % log_text )
-            self.f3.rpc(method, params, worker_name)
-        else:
+        pool = self.active_pool
+        if method == 'eth_submitWork':
+            # Share is valid only on the pool which issued its job
+            job = self.get_job(params[1])
+            if job and job.pool != None and job.pool < len(self.pools):
+                pool = self.pools[job.pool]
+                if not pool.is_connected and settings.REPLAY_QUEUE_SIZE:
+                    log.info( "REPLAY_%s_POOL_DOWN %s" % (get_pool_name(pool.pool_number), log_text) )
+                    self.on_lost_shares(self.replay_queue.put(pool.pool_number, method, params, worker_name))
+                    return
+                elif not pool.is_connected:
+                    log.info( "NO_SUBMIT_%s_POOL_DOWN %s" % (get_pool_name(pool.pool_number), log_text) )
+                    self.workers.get(worker_name).rejected += 1
+                    self.record_share(params, worker_name, journal.LOST)
+                    return
+        if not pool:
             if log_text:
                 log.info( "NO_SUBMIT_ALL_POOLS_DOWN %s" % log_text )
+            if method == 'eth_submitWork':
+                self.workers.get(worker_name).rejected += 1
+                self.record_share(params, worker_name, journal.LOST)
+            return
+
+        if log_text:
+            log.info( "%s %s" % (get_pool_name(pool.pool_number), log_text) )
+        d = pool.rpc(method, params, worker_name)
+        if method == 'eth_submitWork':
+            d.addBoth(self.on_share_result, params, worker_name, pool.pool_number, time.time())
+        else:
+            d.addErrback(self.on_rpc_error, method, pool.pool_number)
+
+    def is_stale(self, params):
+        '''Share of unknown job or of job replaced more than STALE_SHARE_WINDOW ago'''
+        job = self.get_job(params[1])
+        return not job or (job is not self.jobs and time.time()-job.expired_time > settings.STALE_SHARE_WINDOW)
+
+    def flush_replay_queue(self, pool):
+        '''Pool is connected and logged in, send shares which waited for it'''
+        if not len(self.replay_queue):
+            return
+        (delivered, expired) = self.replay_queue.flush(pool.pool_number, self.is_stale)
+        self.on_lost_shares(expired)
+        if delivered:
+            log.info("Replaying %d shares to %s pool" % (len(delivered), get_pool_name(pool.pool_number)))
+        for (method, params, worker_name) in delivered:
+            if not self.submit_queue.put(method, params, worker_name):
+                self.on_lost_shares([(method, params, worker_name)])
+
+    def on_lost_shares(self, shares):
+        '''Queued shares which never reached the pool count as rejected'''
+        for (method, params, worker_name) in shares:
+            log.warning("NO_REPLAY eth_submitWork %s by %s" % (params[0], worker_name))
+            self.workers.get(worker_name).rejected += 1
+            self.record_share(params, worker_name, journal.LOST)
+
+    def on_share_result(self, result, params, worker_name, pool_number, start_time):
+        '''Pool answered eth_submitWork, error counts as rejected share.
+        Share without answer (RPC timeout or lost connection) counts as lost.'''
+        if isinstance(result, Failure) and not result.check(custom_exceptions.RemoteServiceException):
+            log.warning("NO_ANSWER eth_submitWork %s by %s: %s" % (params[0], worker_name, result.getErrorMessage()))
+            self.workers.get(worker_name).rejected += 1
+            self.record_share(params, worker_name, journal.LOST, pool_number)
+            return
+        latency = (time.time()-start_time)*1000
+        self.workers.get(worker_name).add_result(result == True, latency)
+        self.record_share(params, worker_name, journal.ACCEPTED if result == True else journal.REJECTED, pool_number, latency)
+        # Errors of pool were logged by protocol
+        return None if isinstance(result, Failure) else result
+
+    def on_rpc_error(self, failure, method, pool_number):
+        '''Request whose result nobody waits for (eth_submitHashrate) failed'''
+        failure.trap(custom_exceptions.TransportException, custom_exceptions.TimeoutServiceException,
+                     custom_exceptions.RemoteServiceException)
+        log.warning("%s to %s pool failed: %s" % (method, get_pool_name(pool_number), failure.getErrorMessage()))
+
+    def record_share(self, params, worker_name, verdict, pool_number=None, latency=0.0):
+        '''Append verdict of share to journal, pool is taken from share's job unless given'''
+        if not self.journal:
+            return
+        if pool_number == None:
+            job = self.get_job(params[1])
+            pool_number = job.pool if job else None
+        self.journal.append(latency, pool_number, verdict, params[0], params[1], worker_name)
@@ -0,0 +1,215 @@
+'''Append-only binary journal of shares, one file per UTC day in JOURNAL_DIR.
+
+Record is RECORD struct followed by worker name (at most 255 bytes):
+
+    marker    B    RECORD_MARKER, lets readers detect a broken file
+    time      d    unix time of the verdict
+    latency   f    ms between upstream write and pool answer, 0 for verdicts of proxy
+    pool      B    pool number, NO_POOL when share never reached a pool
+    verdict   B    ACCEPTED, REJECTED, STALE, DUPLICATE, INVALID or LOST
+    nonce     Q
+    header    32s  job header
+    name_len  B
+
+Records are packed in reactor thread and written by a thread in batches.
+Every process appends to files of its own (worker processes add suffix to
+the name), so records of processes never interleave. Record cut by crash
+is removed when the process opens the file again, before it appends.'''
+
+import os
+import glob
+import time
+import struct
+import binascii
+
+from twisted.internet import threads, task, defer
+
+import stratum.logger
+log = stratum.logger.get_logger('proxy')
+
+RECORD = struct.Struct('<BdfBBQ32sB')
+RECORD_MARKER = 0xE1
+NO_POOL = 255
+
+# Verdicts
+ACCEPTED = 0
+REJECTED = 1 # By pool
+STALE = 2
+DUPLICATE = 3
+INVALID = 4
+LOST = 5 # Pool was down and share wasn't replayed, or pool never answered
+VERDICTS = ('accepted', 'rejected', 'stale', 'duplicate', 'invalid', 'lost')
+
+def get_path(journal_dir, timestamp, suffix=''):
+    return os.path.join(journal_dir, time.strftime('shares-%Y%m%d', time.gmtime(timestamp)) + suffix + '.bin')
+
+def get_day_paths(journal_dir, timestamp):
+    '''Files of the day of all processes'''
+    return sorted(glob.glob(os.path.join(journal_dir, time.strftime('shares-%Y%m%d*.bin', time.gmtime(timestamp)))))
+
+def get_day(path):
+    '''YYYYMMDD of journal file'''
+    return os.path.basename(path)[7:15]
+
+def pack(timestamp, latency, pool_number, verdict, nonce, header, worker_name):
+    '''Returns record of share, nonce and header are hex strings as miners send them'''
+    try:
+        nonce = int(nonce, 16)
+    except (ValueError, TypeError):
+        nonce = 0
+    try:
+        header = binascii.unhexlify(header[2:] if header.startswith('0x') else header)
+    except (TypeError, AttributeError):
+        header = ''
+    worker_name = worker_name.encode('utf-8') if isinstance(worker_name, unicode) else str(worker_name)
+    worker_name = worker_name[:255]
+    return RECORD.pack(RECORD_MARKER, timestamp, latency, NO_POOL if pool_number == None else pool_number,
+                       verdict, nonce & 0xffffffffffffffff, header, len(worker_name)) + worker_name
+
+def read_records(data):
+    '''Yields (time, latency, pool, verdict, nonce, header, worker name) of records in data, stops at first broken one'''
+    (offset, size, unpack_from) = (0, len(data), RECORD.unpack_from)
+    while offset+RECORD.size <= size:
+        (marker, timestamp, latency, pool_number, verdict, nonce, header, name_len) = unpack_from(data, offset)
+        end = offset + RECORD.size + name_len
+        if marker != RECORD_MARKER or end > size:
+            break
+        yield (timestamp, latency, pool_number, verdict, nonce, header, data[offset+RECORD.size:end])
+        offset = end
+
+def get_valid_size(data):
+    '''Bytes of whole records at start of data'''
+    (offset, size) = (0, len(data))
+    while offset+RECORD.size <= size:
+        (marker, name_len) = (ord(data[offset]), ord(data[offset+RECORD.size-1]))
+        end = offset + RECORD.size + name_len
+        if marker != RECORD_MARKER or end > size:
+            break
+        offset = end
+    return offset
+
+def repair(path):
+    '''Truncates file after its last whole record, returns number of bytes removed'''
+    if not os.path.isfile(path):
+        return 0
+    fp = open(path, 'r+b')
+    try:
+        data = fp.read()
+        valid = get_valid_size(data)
+        if valid < len(data):
+            fp.truncate(valid)
+        return len(data) - valid
+    finally:
+        fp.close()
+
+class ShareJournal(object):
+    '''Buffers records in memory and appends them to journal file of the day from a thread'''
+
+    def __init__(self, journal_dir, flush_interval=1.0, max_buffer=10000, suffix=''):
+        self.journal_dir = journal_dir
+        self.suffix = suffix # Of file names, every process needs its own
+        self.repaired = set() # Files checked for cut record since start
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer # Records, buffer is written early when it gets longer
+        self.buffer = []
+        self.writing = None # Deferred of write in progress
+        self.written = 0
+        self.errors = 0
+        self.loop = task.LoopingCall(self.flush)
+
+    def start(self):
+        if not os.path.isdir(self.journal_dir):
+            os.makedirs(self.journal_dir)
+        self.loop.start(self.flush_interval, now=False)
+
+    def stop(self):
+        '''Write rest of buffer once write in progress is done, reactor is shutting down.
+        Returns Deferred, so 'before shutdown' trigger waits for it.'''
+        if self.loop.running:
+            self.loop.stop()
+        done = defer.Deferred()
+
+        def write_rest(result):
+            try:
+                (records, self.buffer) = (self.buffer, [])
+                self.write(records)
+            finally:
+                done.callback(None)
+            return result
+
+        if self.writing:
+            self.writing.addBoth(write_rest)
+        else:
+            write_rest(None)
+        return done
+
+    def append(self, latency, pool_number, verdict, nonce, header, worker_name):
+        self.buffer.append(pack(time.time(), latency, pool_number, verdict, nonce, header, worker_name))
+        if len(self.buffer) >= self.max_buffer:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer or self.writing:
+            # Records wait for next flush, writes never overlap
+            return
+        (records, self.buffer) = (self.buffer, [])
+        self.writing = threads.deferToThread(self.write, records)
+        self.writing.addBoth(self.on_written)
+
+    def on_written(self, result):
+        self.writing = None
+        return result
+
+    def write(self, records):
+        '''Runs in thread'''
+        if not records:
+            return
+        try:
+            path = get_path(self.journal_dir, time.time(), self.suffix)
+            if path not in self.repaired:
+                # Previous run may have crashed in the middle of a record
+                removed = repair(path)
+                if removed:
+                    log.warning("Cut record (%d bytes) removed from end of %s" % (removed, path))
+                self.repaired.add(path)
+            fp = open(path, 'ab')
+            try:
+                fp.write(''.join(records))
+            finally:
+                fp.close()
+            self.written += len(records)
+        except (IOError, OSError) as e:
+            self.errors += 1
+            log.error("Cannot write share journal: %s" % e)
+
+    def restore(self, workers, max_age):
+        '''Rebuild counters of workers from records of last max_age seconds, returns number of records'''
+        now = time.time()
+        since = now - max_age
+        paths = []
+        day = since
+        while day < now + 86400:
+            for path in get_day_paths(self.journal_dir, day):
+                if path not in paths:
+                    paths.append(path)
+            day += 86400
+
+        count = 0
+        for path in paths:
+            fp = open(path, 'rb')
+            try:
+                data = fp.read()
+            finally:
+                fp.close()
+            for (timestamp, latency, pool_number, verdict, nonce, header, worker_name) in read_records(data):
+                if timestamp < since:
+                    continue
+                worker = workers.get(worker_name)
+                if verdict == ACCEPTED or verdict == REJECTED:
+                    worker.add_result(verdict == ACCEPTED, latency)
+                else:
+                    worker.rejected += 1
+                if timestamp > worker.last_submit:
+                    worker.last_submit = timestamp
+                count += 1
+        return count
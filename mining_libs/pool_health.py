@@ -0,0 +1,127 @@
+import time
+
+from twisted.internet import task
+
+import stratum.logger
+log = stratum.logger.get_logger('proxy')
+
+# States of pool
+UP = 'up'
+SUSPECT = 'suspect' # Connected, but slow or without new jobs, used only when no pool is up
+DOWN = 'down'
+
+class PoolHealth(object):
+    '''Health of one pool'''
+    __slots__ = ('state', 'since', 'reason', 'ping_sent', 'rtt', 'header', 'job_time')
+
+    def __init__(self):
+        self.state = DOWN
+        self.since = time.time() # When state was entered
+        self.reason = "not connected"
+        self.ping_sent = None # When unanswered heartbeat was sent
+        self.rtt = None # Seconds, last heartbeat
+        self.header = None
+        self.job_time = None # When pool sent job with new header
+
+class HealthMonitor(object):
+    '''Health state machine of every pool.
+
+    Connected pool is SUSPECT until it answers first heartbeat (eth_getWork
+    ping), so pool which accepts connections but doesn't answer isn't taken
+    back over and over. Pool is UP after fast answer with fresh job and
+    becomes SUSPECT when heartbeat isn't answered within half of timeout or
+    pool sends no new job for job_timeout seconds. Pool which doesn't answer
+    heartbeat within timeout is DOWN and its connection is aborted, so it
+    reconnects. TCP errors make pool DOWN at once.
+
+    on_change() is called on every change, JobRegistry then picks another
+    active pool. With timeout 0 only connects and disconnects are tracked.'''
+
+    def __init__(self, pools, timeout, job_timeout, on_change):
+        self.pools = pools
+        self.timeout = timeout # Seconds
+        self.job_timeout = job_timeout # Seconds, 0 disables missed job detection
+        self.on_change = on_change
+        self.states = [ PoolHealth() for _ in pools ] # Indexed by pool_number
+        self.loop = task.LoopingCall(self.check)
+
+    def start(self):
+        if self.timeout:
+            # Checks are cheap, run them often enough to keep failover within the budget
+            self.loop.start(max(self.timeout / 10, 0.01), now=False)
+
+    def get(self, pool_number):
+        return self.states[pool_number]
+
+    def is_healthy(self, pool_number):
+        return self.states[pool_number].state == UP
+
+    def is_usable(self, pool_number):
+        '''Pool is connected and not DOWN, its connection may be still closing'''
+        return self.pools[pool_number].is_connected and self.states[pool_number].state != DOWN
+
+    def set_state(self, pool_number, state, reason):
+        health = self.states[pool_number]
+        if health.state == state:
+            return
+        f = self.pools[pool_number]
+        if state == UP:
+            log.info("Pool %s:%d is up" % f.main_host)
+        else:
+            log.warning("Pool %s:%d is %s: %s" % (f.main_host + (state, reason)))
+        (health.state, health.since, health.reason) = (state, time.time(), reason)
+        self.on_change()
+
+    def on_connect(self, pool_number):
+        health = self.states[pool_number]
+        # Login and first heartbeat must be answered within timeout too
+        (health.ping_sent, health.rtt, health.job_time) = (time.time(), None, time.time())
+        if not self.timeout:
+            self.set_state(pool_number, UP, "")
+        else:
+            (health.state, health.since, health.reason) = (SUSPECT, time.time(), "waiting for first heartbeat")
+            self.on_change()
+
+    def on_disconnect(self, pool_number):
+        self.set_state(pool_number, DOWN, "disconnected")
+
+    def on_ping_sent(self, pool_number):
+        health = self.states[pool_number]
+        if health.ping_sent == None:
+            health.ping_sent = time.time()
+
+    def on_ping_reply(self, pool_number, rtt):
+        health = self.states[pool_number]
+        (health.ping_sent, health.rtt) = (None, rtt)
+        self.check_pool(self.pools[pool_number], time.time())
+
+    def on_job(self, pool_number, header):
+        health = self.states[pool_number]
+        if health.header != header:
+            (health.header, health.job_time) = (header, time.time())
+
+    def check(self):
+        now = time.time()
+        for f in self.pools:
+            if f.is_connected:
+                self.check_pool(f, now)
+
+    def check_pool(self, f, now):
+        health = self.states[f.pool_number]
+        if health.state == DOWN or not self.timeout:
+            return
+        if health.ping_sent != None and now-health.ping_sent > self.timeout:
+            self.set_state(f.pool_number, DOWN, "no answer for %dms" % ((now-health.ping_sent) * 1000))
+            if f.client and f.client.transport:
+                f.client.transport.abortConnection()
+        elif health.ping_sent != None and now-health.ping_sent > self.timeout / 2:
+            self.set_state(f.pool_number, SUSPECT, "no answer for %dms" % ((now-health.ping_sent) * 1000))
+        elif health.rtt == None:
+            # First heartbeat wasn't answered yet
+            return
+        elif health.rtt > self.timeout / 2:
+            self.set_state(f.pool_number, SUSPECT, "answered in %dms" % (health.rtt * 1000))
+        elif self.job_timeout and now-health.job_time > self.job_timeout:
+            self.set_state(f.pool_number, SUSPECT, "no new job for %ds" % (now-health.job_time))
+        else:
+            self.set_state(f.pool_number, UP, "")
@@ -0,0 +1,112 @@
+import time
+
+import stratum.logger
+log = stratum.logger.get_logger('proxy')
+
+class PoolLatency(object):
+    '''Smoothed latency estimates of one pool, in seconds'''
+    __slots__ = ('rtt', 'rtt_samples', 'job_lag', 'job_lag_samples', 'header')
+
+    def __init__(self):
+        self.rtt = None # Round-trip time of ping
+        self.rtt_samples = 0
+        self.job_lag = None # How late new jobs come compared to the fastest pool
+        self.job_lag_samples = 0
+        self.header = None # Header of last job from this pool
+
+class LatencyTable(object):
+    '''Latency of every pool and the 'latency' policy of active pool selection.
+
+    Ping round-trip times are averaged by EWMA. Job lag is measured on new
+    blocks: pools announce new block within a few hundred ms of each other,
+    so new jobs of different pools arriving within job_window seconds are
+    taken as one block, the first pool gets lag 0 and the others get their
+    delay after it. Jobs seen by one pool only (work refreshes) are ignored.
+
+    Pool is scored by rtt + job lag. Active pool is replaced only when
+    another one scores better by margin seconds for delay seconds in a row.'''
+
+    def __init__(self, pools, margin, delay, alpha=0.2, min_samples=3, job_window=2.0):
+        self.pools = pools
+        self.margin = margin
+        self.delay = delay
+        self.alpha = alpha # Weight of new sample
+        self.min_samples = min_samples # Pool isn't scored before this many pings
+        self.job_window = job_window
+        self.latencies = [ PoolLatency() for _ in pools ] # Indexed by pool_number
+        self.block_time = None # Arrival of first job of current block
+        self.block_pools = [] # Pool numbers which sent job of current block, in arrival order
+        self.candidate = None # Pool which scores better than active one
+        self.candidate_since = None
+
+    def get(self, pool_number):
+        return self.latencies[pool_number]
+
+    def add_rtt(self, pool_number, rtt):
+        latency = self.latencies[pool_number]
+        if latency.rtt == None:
+            latency.rtt = rtt
+        else:
+            latency.rtt += self.alpha * (rtt-latency.rtt)
+        latency.rtt_samples += 1
+
+    def add_job_lag(self, pool_number, lag):
+        latency = self.latencies[pool_number]
+        if latency.job_lag == None:
+            latency.job_lag = lag
+        else:
+            latency.job_lag += self.alpha * (lag-latency.job_lag)
+        latency.job_lag_samples += 1
+
+    def add_job(self, pool_number, header, now=None):
+        '''Call on every job received from pool'''
+        now = now or time.time()
+        latency = self.latencies[pool_number]
+        if latency.header == header:
+            return
+        latency.header = header
+
+        if self.block_time == None or now-self.block_time > self.job_window or pool_number in self.block_pools:
+            # First pool with new block, it's scored once another pool follows
+            self.block_time = now
+            self.block_pools = [pool_number]
+            return
+        if len(self.block_pools) == 1:
+            self.add_job_lag(self.block_pools[0], 0.0)
+        self.block_pools.append(pool_number)
+        self.add_job_lag(pool_number, now-self.block_time)
+
+    def get_score(self, pool_number):
+        '''Seconds, None until pool was pinged min_samples times'''
+        latency = self.latencies[pool_number]
+        if latency.rtt_samples < self.min_samples:
+            return None
+        return latency.rtt + (latency.job_lag or 0.0)
+
+    def select(self, active, connected, now=None):
+        '''Returns pool which should be active, active is current active pool or None
+        and connected are pools to choose from'''
+        now = now or time.time()
+        if not connected:
+            return None
+
+        # Scored pools by score, then unscored ones by priority
+        best = min(connected, key=lambda f: (self.get_score(f.pool_number) == None, self.get_score(f.pool_number), f.pool_number))
+        if active not in connected:
+            self.candidate = None
+            return best
+
+        (best_score, active_score) = (self.get_score(best.pool_number), self.get_score(active.pool_number))
+        if best is active or best_score == None or active_score == None or best_score+self.margin >= active_score:
+            self.candidate = None
+            return active
+
+        if best is not self.candidate:
+            self.candidate = best
+            self.candidate_since = now
+        if now-self.candidate_since < self.delay:
+            return active
+
+        log.info("Pool %s:%d is faster than %s:%d (%.1fms vs %.1fms)" % (best.main_host + active.main_host + (best_score*1000, active_score*1000)))
+        self.candidate = None
+        return best
@@ -0,0 +1,306 @@
+'''WORKER_PROCESSES mode: miners are served by child processes sharing one port.
+
+Master process owns pool connections and JobRegistry. It spawns worker
+processes ("eth-proxy.py --worker") and talks to each of them by JSON lines
+over the child's stdin/stdout:
+
+    master -> worker  {"method": "job", "params": [job params, pool number]}
+                      {"method": "page", "params": [page id, response code, content type, body]}
+    worker -> master  {"method": "submit", "params": [method, params, worker name]}
+                      {"method": "hashrate", "params": [worker name, params]}
+                      {"method": "stats", "params": [share counters, {worker name: [rejected, last getwork, last submit]}]}
+                      {"method": "page", "params": [page id, path]}
+
+Every worker binds miner port with SO_REUSEPORT, so kernel spreads
+connections among them. Workers check shares (stale, duplicate, VERIFY_SHARES)
+and hand over only good ones, master submits them in single pool session.
+Master checks duplicates once more, the same share may reach two workers.
+
+Master alone knows pools and verdicts of pool, so it renders status pages
+(/, /workers, /hashrate, /metrics, /health) for every worker. Workers send
+it their counters of shares refused locally once a second and start them
+from zero again.'''
+
+import os
+import sys
+import socket
+
+from twisted.internet import reactor, protocol, stdio, task, error
+from twisted.protocols.basic import LineOnlyReceiver
+from twisted.web.server import Site, NOT_DONE_YET
+
+from stratum import settings
+from stratum import codec
+from stratum.framer import LineFramer
+import jobs
+import journal
+import hashrate
+import workers
+import getwork_listener
+import stratum.logger
+log = stratum.logger.get_logger('proxy')
+
+def set_keepalive(sock):
+    '''Keepalive of miner port, accepted connections inherit it, so dead miners are reaped'''
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1) # Enable keepalive packets
+        sock.setsockopt(socket.SOL_TCP, socket.TCP_KEEPIDLE, 60) # Seconds before sending keepalive probes
+        sock.setsockopt(socket.SOL_TCP, socket.TCP_KEEPINTVL, 1) # Interval in seconds between keepalive probes
+        sock.setsockopt(socket.SOL_TCP, socket.TCP_KEEPCNT, 5) # Failed keepalive probles before declaring other end dead
+    except:
+        pass # Some socket features are not available on all platforms (you can guess which one)
+
+def listen_reuseport(port, factory, interface=''):
+    '''listenTCP() with SO_REUSEPORT, more processes can listen on the same port'''
+    family = socket.AF_INET6 if ':' in interface else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        set_keepalive(sock)
+        sock.bind((interface, port))
+        sock.listen(1024)
+        sock.setblocking(False)
+        return reactor.adoptStreamPort(sock.fileno(), family, factory)
+    finally:
+        # Reactor keeps its own copy of descriptor
+        sock.close()
+
+class WorkerProcess(protocol.ProcessProtocol):
+    '''Master side of one worker process'''
+    def __init__(self, pool, number):
+        self.pool = pool
+        self.number = number
+        self.framer = LineFramer()
+
+    def connectionMade(self):
+        log.info("Worker process %d started (pid %d)" % (self.number, self.transport.pid))
+        if self.pool.job_registry.jobs:
+            self.send_job(self.pool.job_registry.jobs)
+
+    def send(self, method, params):
+        self.transport.write(codec.dumps({'method': method, 'params': params}) + '\n')
+
+    def send_job(self, job):
+        self.send('job', [job.params, job.pool])
+
+    def outReceived(self, data):
+        for line in self.framer.feed(data):
+            try:
+                message = codec.loads(line)
+                self.pool.handle_message(self, message['method'], message['params'])
+            except Exception:
+                log.exception("Bad message from worker process %d: %s" % (self.number, line[:200]))
+
+    def processEnded(self, reason):
+        log.warning("Worker process %d ended: %s" % (self.number, reason.value))
+        self.pool.on_worker_ended(self)
+
+class WorkerPool(object):
+    '''Spawns worker processes, broadcasts jobs to them and submits their shares'''
+    def __init__(self, job_registry, count):
+        self.job_registry = job_registry
+        self.count = count
+        self.workers = {} # number -> WorkerProcess
+        self.stopping = False
+        # Status pages of miner port, rendered for workers
+        self.root = getwork_listener.Root(job_registry, settings.ENABLE_WORKER_ID)
+
+    def start(self):
+        for number in xrange(self.count):
+            self.spawn(number)
+        self.job_registry.on_block.addCallback(self.on_block)
+        reactor.addSystemEventTrigger('before', 'shutdown', self.stop)
+
+    def spawn(self, number):
+        worker = WorkerProcess(self, number)
+        script = os.path.abspath(sys.argv[0])
+        reactor.spawnProcess(worker, sys.executable, [sys.executable, script, '--worker', str(number)],
+                             env=os.environ, path=os.getcwd(), childFDs={0: 'w', 1: 'r', 2: 2})
+        self.workers[number] = worker
+
+    def stop(self):
+        '''Worker process exits once its stdin is closed'''
+        self.stopping = True
+        for worker in self.workers.values():
+            worker.transport.closeStdin()
+
+    def on_worker_ended(self, worker):
+        if self.workers.get(worker.number) is worker:
+            del self.workers[worker.number]
+        if not self.stopping:
+            reactor.callLater(1, self.spawn, worker.number)
+
+    def on_block(self, result):
+        for worker in self.workers.values():
+            worker.send_job(self.job_registry.jobs)
+        # Hook to on_block again
+        self.job_registry.on_block.addCallback(self.on_block)
+        return result
+
+    def handle_message(self, worker, method, params):
+        if method == 'submit':
+            # Already checked by worker, but the same share may come via other worker too
+            (method, params, worker_name) = params
+            job_registry = self.job_registry
+            if method == 'eth_submitWork' and not job_registry.share_index.add(params[0], params[1], params[2]):
+                job_registry.workers.get(worker_name).rejected += 1
+                job_registry.record_share(params, worker_name, journal.DUPLICATE)
+                log.warning("DUPLICATE eth_submitWork %s by %s (via other worker process)" % (params[0], worker_name))
+            elif not job_registry.submit_queue.put(method, params, worker_name):
+                if method == 'eth_submitWork':
+                    job_registry.share_index.remove(params[0], params[1], params[2])
+                    job_registry.workers.get(worker_name).rejected += 1
+                    job_registry.record_share(params, worker_name, journal.LOST)
+                log.warning("NO_SUBMIT_QUEUE_FULL %s by %s" % (method, worker_name))
+        elif method == 'hashrate':
+            (worker_name, params) = params
+            self.job_registry.hashrates.update(worker_name, params)
+        elif method == 'stats':
+            self.add_stats(*params)
+        elif method == 'page':
+            (page_id, path) = params
+            worker.send('page', [page_id] + list(self.root.get_page(path)))
+        else:
+            log.error("Unknown message %s from worker process" % method)
+
+    def add_stats(self, counters, worker_stats):
+        '''Counters of worker process since its last report'''
+        job_registry = self.job_registry
+        job_registry.fresh_shares += counters['fresh']
+        job_registry.late_shares += counters['late']
+        job_registry.stale_shares += counters['stale']
+        job_registry.invalid_shares += counters['invalid']
+        job_registry.share_index.duplicates += counters['duplicate']
+        getwork_listener.GETWORK_REQUESTS.inc(counters['getwork'])
+        for worker_name, (rejected, last_getwork, last_submit) in worker_stats.iteritems():
+            worker = job_registry.workers.get(worker_name)
+            worker.rejected += rejected
+            worker.last_getwork = max(worker.last_getwork, last_getwork)
+            worker.last_submit = max(worker.last_submit, last_submit)
+
+class MasterChannel(LineOnlyReceiver):
+    '''Worker side of IPC, on stdin/stdout of worker process'''
+    delimiter = '\n'
+    MAX_LENGTH = 1024 * 1024
+
+    def __init__(self):
+        self.job_registry = None
+        self.pages = {} # page id -> request waiting for page from master
+        self.page_id = 0
+
+    def send(self, method, params):
+        self.transport.write(codec.dumps({'method': method, 'params': params}) + '\n')
+
+    def request_page(self, request):
+        self.page_id += 1
+        page_id = self.page_id
+        self.pages[page_id] = request
+        request.notifyFinish().addErrback(lambda failure: self.pages.pop(page_id, None))
+        self.send('page', [page_id, request.path])
+
+    def lineReceived(self, line):
+        message = codec.loads(line)
+        if message['method'] == 'job':
+            (params, pool) = message['params']
+            job = jobs.Job.build_from_pool(params)
+            job.pool = pool
+            self.job_registry.install_job(job)
+        elif message['method'] == 'page':
+            (page_id, code, content_type, body) = message['params']
+            request = self.pages.pop(page_id, None)
+            if request == None:
+                # Client went away meanwhile
+                return
+            request.setResponseCode(code)
+            request.setHeader('content-type', content_type.encode('utf-8'))
+            request.write(body.encode('utf-8'))
+            request.finish()
+
+    def connectionLost(self, reason):
+        # Master is gone
+        try:
+            reactor.stop()
+        except error.ReactorNotRunning:
+            pass
+
+class WorkerHashrates(hashrate.HashrateTable):
+    '''Averages are kept locally for /hashrate, reports go to master which submits them upstream'''
+    def __init__(self, channel, *args, **kwargs):
+        hashrate.HashrateTable.__init__(self, *args, **kwargs)
+        self.channel = channel
+
+    def update(self, worker_name, params):
+        hashrate.HashrateTable.update(self, worker_name, params)
+        self.channel.send('hashrate', [worker_name, params])
+
+class WorkerRegistry(workers.WorkerRegistry):
+    '''Remembers workers seen since last report to master'''
+    def __init__(self, max_workers):
+        workers.WorkerRegistry.__init__(self, max_workers)
+        self.changed = set()
+
+    def get(self, name):
+        self.changed.add(name)
+        return workers.WorkerRegistry.get(self, name)
+
+class WorkerJobRegistry(jobs.JobRegistry):
+    '''JobRegistry of worker process, jobs come from master and checked shares go back to it'''
+    def __init__(self, channel):
+        jobs.JobRegistry.__init__(self, [])
+        self.channel = channel
+        self.workers = WorkerRegistry(settings.MAX_WORKERS)
+        self.hashrates = WorkerHashrates(channel, self.workers, self.submit,
+                                         settings.HASHRATE_REPORT_INTERVAL, settings.HASHRATE_REPORT_MODE)
+        self.stats = task.LoopingCall(self.send_stats)
+
+    def submit_upstream(self, method, params, worker_name):
+        self.channel.send('submit', [method, params, worker_name])
+
+    def send_stats(self):
+        '''Hand over counters to master, which serves them on status pages, and start them from zero'''
+        counters = {'fresh': self.fresh_shares, 'late': self.late_shares, 'stale': self.stale_shares,
+                    'invalid': self.invalid_shares, 'duplicate': self.share_index.duplicates,
+                    'getwork': getwork_listener.GETWORK_REQUESTS.value}
+        (self.fresh_shares, self.late_shares, self.stale_shares, self.invalid_shares) = (0, 0, 0, 0)
+        self.share_index.duplicates = 0
+        getwork_listener.GETWORK_REQUESTS.value = 0
+
+        worker_stats = {}
+        for worker_name in self.workers.changed:
+            worker = self.workers.workers.get(worker_name)
+            if worker == None:
+                # Evicted meanwhile
+                continue
+            worker_stats[worker_name] = [worker.rejected, worker.last_getwork, worker.last_submit]
+            worker.rejected = 0
+        self.workers.changed.clear()
+        if any(counters.values()) or worker_stats:
+            self.channel.send('stats', [counters, worker_stats])
+
+class WorkerRoot(getwork_listener.Root):
+    '''Miner port of worker process, status pages come from master'''
+    def register_metrics(self):
+        # Metrics are rendered by master
+        pass
+
+    def render_GET(self, request):
+        self.job_registry.channel.request_page(request)
+        return NOT_DONE_YET
+
+def worker_main(number):
+    '''Entry point of worker process'''
+    log.info("Worker process %d listening on port %d" % (number, settings.PORT))
+    channel = MasterChannel()
+    job_registry = WorkerJobRegistry(channel)
+    channel.job_registry = job_registry
+    stdio.StandardIO(channel)
+    if job_registry.journal:
+        # Stale, duplicate and invalid shares are journaled here, pool verdicts by master
+        job_registry.journal.suffix = '-w%d' % number
+        job_registry.journal.start()
+        reactor.addSystemEventTrigger('before', 'shutdown', job_registry.journal.stop)
+
+    job_registry.stats.start(1, now=False)
+
+    listen_reuseport(settings.PORT, Site(WorkerRoot(job_registry, settings.ENABLE_WORKER_ID)), settings.HOST)
@@ -0,0 +1,65 @@
+import time
+from collections import deque
+
+import stratum.logger
+log = stratum.logger.get_logger('proxy')
+
+class ReplayQueue(object):
+    '''Bounded queue of shares which couldn't be delivered because their pool was down.
+    Shares are sent once the pool is back, unless they got older than max_age seconds
+    or their job went stale. When queue is full, the oldest share is dropped.'''
+
+    def __init__(self, limit, max_age):
+        self.limit = limit
+        self.max_age = max_age
+        self.queue = deque() # (queued time, pool number, method, params, worker name), oldest first
+
+        # Counters
+        self.queued = 0
+        self.delivered = 0
+        self.expired = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.queue)
+
+    def expire(self, now):
+        '''Removes shares older than max_age and returns them'''
+        expired = []
+        while self.queue and now-self.queue[0][0] > self.max_age:
+            expired.append(self.queue.popleft()[2:])
+        self.expired += len(expired)
+        return expired
+
+    def put(self, pool_number, method, params, worker_name):
+        '''Returns list of (method, params, worker_name) which were expired or dropped to make room'''
+        lost = self.expire(time.time())
+        if len(self.queue) >= self.limit:
+            lost.append(self.queue.popleft()[2:])
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                log.warning("Replay queue is full (%d shares), dropping the oldest ones" % self.limit)
+        self.queue.append((time.time(), pool_number, method, params, worker_name))
+        self.queued += 1
+        return lost
+
+    def flush(self, pool_number, is_stale):
+        '''Returns (delivered, expired) lists of (method, params, worker_name) queued for the pool.
+        is_stale(params) tells whether job of share went stale.'''
+        expired = self.expire(time.time())
+        (delivered, kept) = ([], deque())
+        for item in self.queue:
+            if item[1] != pool_number:
+                kept.append(item)
+            elif is_stale(item[3]):
+                expired.append(item[2:])
+                self.expired += 1
+            else:
+                delivered.append(item[2:])
+        self.queue = kept
+        self.delivered += len(delivered)
+        return (delivered, expired)
+
+    def get_stats(self):
+        return {'depth': len(self.queue), 'queued': self.queued, 'delivered': self.delivered,
+                'expired': self.expired, 'dropped': self.dropped}
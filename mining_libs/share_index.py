@@ -0,0 +1,48 @@
+import time
+from collections import OrderedDict
+
+class ShareIndex(object):
+    '''Remembers shares submitted for recent jobs, grouped by job header.
+    Lookup is O(1), whole job is forgotten once it gets older than max_age
+    or when more than max_jobs jobs are remembered, so memory stays flat.'''
+
+    def __init__(self, max_age, max_jobs=64, max_shares_per_job=100000):
+        self.max_age = max_age
+        self.max_jobs = max_jobs
+        self.max_shares_per_job = max_shares_per_job
+        self.jobs = OrderedDict() # header -> (time of first share, set of (nonce, mix digest))
+        self.duplicates = 0
+
+    def expire(self, now):
+        while self.jobs:
+            header = next(self.jobs.iterkeys())
+            if len(self.jobs) <= self.max_jobs and now-self.jobs[header][0] <= self.max_age:
+                break
+            del self.jobs[header]
+
+    def add(self, nonce, header, mix_digest):
+        '''Returns False when the same share was already submitted'''
+        now = time.time()
+        self.expire(now)
+
+        header = str(header).lower()
+        key = (str(nonce).lower(), str(mix_digest).lower())
+        job = self.jobs.get(header)
+        if job == None:
+            job = self.jobs[header] = (now, set())
+        elif key in job[1]:
+            self.duplicates += 1
+            return False
+
+        if len(job[1]) < self.max_shares_per_job:
+            job[1].add(key)
+        return True
+
+    def remove(self, nonce, header, mix_digest):
+        '''Forget share which wasn't submitted after all, so miner can send it again'''
+        job = self.jobs.get(str(header).lower())
+        if job != None:
+            job[1].discard((str(nonce).lower(), str(mix_digest).lower()))
+
+    def __len__(self):
+        return sum([ len(job[1]) for job in self.jobs.itervalues() ])
@@ -0,0 +1,125 @@
+from twisted.python.failure import Failure
+
+from stratum.protocol import Protocol
+from stratum.socket_transport import SocketTransportFactory
+from stratum.event_handler import GenericEventHandler
+from stratum.pubsub import Pubsub, Subscription
+from stratum import custom_exceptions
+from stratum import settings
+from stratum import codec
+from workers import worker_name_from_ip
+import stratum.logger
+log = stratum.logger.get_logger('proxy')
+
+class MinerProtocol(Protocol):
+    '''Server side of stratum connection. Miners call methods, proxy answers them
+    and pushes new jobs via subscriptions.'''
+
+    def lineReceived(self, line, request_counter):
+        try:
+            message = codec.loads(line)
+        except:
+            request_counter.finish()
+            raise custom_exceptions.ProtocolException("Cannot decode message '%s'" % line.strip())
+
+        if self.factory.debug:
+            log.debug("> %s" % message)
+
+        msg_id = message.get('id', 0)
+        msg_method = message.get('method', None)
+        msg_params = message.get('params', None)
+
+        if message.get('worker'):
+            # EthProxy clients (Claymore) send rig name with every request
+            self.session['worker'] = str(message['worker'])[:32]
+
+        if not msg_method:
+            request_counter.finish()
+            raise custom_exceptions.ProtocolException("Cannot handle message '%s'" % line.strip())
+
+        try:
+            result = self.event_handler._handle_event(msg_method, msg_params, connection_ref=self)
+        except:
+            self.process_failure(Failure(), msg_id, request_counter)
+            return
+
+        result.addCallback(self.process_response, msg_id, None, None, request_counter)
+        result.addErrback(self.process_failure, msg_id, request_counter)
+
+    def writeJsonResponse(self, data, message_id):
+        '''Miners expect answer for every request, including False ones'''
+        serialized = codec.dumps({'id': message_id, 'result': data, 'error': None, 'jsonrpc':'2.0'})
+
+        if self.factory.debug:
+            log.debug("< %s" % serialized)
+
+        self.transport_write("%s\n" % serialized)
+
+class NewJobSubscription(Subscription):
+    '''Pushes current job to miners in EthProxy format, {"id":0,"result":[header, seed, boundary]}'''
+    event = 'eth_getWork'
+
+    def emit_single(self, *args, **kwargs):
+        conn = self.connection_ref()
+        if conn == None or conn.transport == None:
+            # Connection is closed
+            return
+
+        job_registry = conn.factory.job_registry
+        if job_registry.jobs:
+            conn.transport_write(job_registry.getwork_response(0)+'\n')
+
+    def after_subscribe(self, result):
+        # Send current job right after login response
+        self.emit_single()
+        return result
+
+class EthProxyService(GenericEventHandler):
+    '''Handles miner requests in EthProxy stratum dialect'''
+
+    def get_worker_name(self, connection_ref):
+        if not settings.ENABLE_WORKER_ID:
+            return ''
+        worker_name = connection_ref.session.get('worker')
+        if not worker_name:
+            worker_name = worker_name_from_ip(connection_ref._get_ip())
+        return worker_name
+
+    def handle_event(self, method, params, connection_ref):
+        job_registry = connection_ref.factory.job_registry
+
+        if method == 'eth_submitLogin':
+            # Wallet is configured on proxy, login param is used only for rig name
+            if params and not connection_ref.session.get('worker') and '.' in str(params[0]):
+                connection_ref.session['worker'] = str(params[0]).split('.', 1)[1][:32]
+            if not connection_ref.session.get('subscriptions'):
+                Pubsub.subscribe(connection_ref, NewJobSubscription())
+            return True
+
+        elif method == 'eth_getWork':
+            if not job_registry.jobs:
+                raise custom_exceptions.ServiceException("Proxy is waiting for a job...")
+            return job_registry.jobs.params
+
+        elif method == 'eth_submitWork':
+            return job_registry.submit(method, params, self.get_worker_name(connection_ref))
+
+        elif method == 'eth_submitHashrate':
+            job_registry.hashrates.update(self.get_worker_name(connection_ref), params)
+            return True
+
+        raise custom_exceptions.MethodNotFoundException("Unsupported method '%s'" % method)
+
+class StratumListenerFactory(SocketTransportFactory):
+    '''Miner-facing stratum listener, new jobs are pushed to every logged in miner'''
+    def __init__(self, job_registry, debug=False, event_handler=EthProxyService):
+        SocketTransportFactory.__init__(self, debug=debug, event_handler=event_handler)
+        self.protocol = MinerProtocol
+        self.job_registry = job_registry
+        job_registry.on_block.addCallback(self.on_block)
+
+    def on_block(self, result):
+        NewJobSubscription.emit()
+        # Hook to on_block again
+        self.job_registry.on_block.addCallback(self.on_block)
+        return result
@@ -0,0 +1,74 @@
+import time
+from collections import deque
+
+from twisted.internet import reactor
+
+import stratum.logger
+log = stratum.logger.get_logger('proxy')
+
+class SubmitQueue(object):
+    '''Bounded queue of shares and hashrates waiting for upstream write.
+    It is drained by reactor, so pool connection is written only from reactor thread.
+    When queue is full, put() refuses new items and listener tells it to the miner.'''
+
+    def __init__(self, send, limit, batch=100):
+        self.send = send # Callable(method, params, worker_name) doing the upstream write
+        self.limit = limit
+        self.batch = batch # Max items written per reactor iteration
+        self.queue = deque()
+        self.drain_call = None
+        self.is_full = False
+
+        # Counters
+        self.queued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.wait_total = 0.0 # Sum of seconds between put() and upstream write
+        self.wait_max = 0.0
+
+    def __len__(self):
+        return len(self.queue)
+
+    def put(self, method, params, worker_name):
+        if len(self.queue) >= self.limit:
+            if not self.is_full:
+                self.is_full = True
+                log.warning("Submit queue is full (%d items), refusing shares" % self.limit)
+            self.dropped += 1
+            return False
+
+        self.queue.append((time.time(), method, params, worker_name))
+        self.queued += 1
+        if len(self.queue) > self.max_depth:
+            self.max_depth = len(self.queue)
+
+        if self.drain_call == None:
+            self.drain_call = reactor.callLater(0, self.drain)
+        return True
+
+    def drain(self):
+        self.drain_call = None
+        self.is_full = False
+        for _ in xrange(min(self.batch, len(self.queue))):
+            (queued_time, method, params, worker_name) = self.queue.popleft()
+            try:
+                self.send(method, params, worker_name)
+            except Exception:
+                log.exception("Upstream write of %s failed" % method)
+
+            wait = time.time() - queued_time
+            self.wait_total += wait
+            if wait > self.wait_max:
+                self.wait_max = wait
+            self.sent += 1
+
+        if self.queue:
+            # Let reactor serve miners before writing next batch
+            self.drain_call = reactor.callLater(0, self.drain)
+
+    def get_stats(self):
+        return {'depth': len(self.queue), 'max_depth': self.max_depth, 'queued': self.queued,
+                'sent': self.sent, 'dropped': self.dropped,
+                'wait_avg_ms': self.wait_total / self.sent * 1000 if self.sent else 0.0,
+                'wait_max_ms': self.wait_max * 1000}
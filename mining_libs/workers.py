@@ -0,0 +1,77 @@
+import socket
+import time
+from collections import OrderedDict
+
+def worker_name_from_ip(ip):
+    '''Numeric worker name of miner without name, IPv4 as before (1.2.3.4 -> "16909060"), IPv6 as 128-bit integer'''
+    if ip.startswith('::ffff:') and '.' in ip:
+        # IPv4-mapped IPv6 address
+        ip = ip[7:]
+    try:
+        packed = socket.inet_aton(ip) if '.' in ip else socket.inet_pton(socket.AF_INET6, ip)
+    except (socket.error, ValueError):
+        return ''
+    return str(int(packed.encode('hex'), 16))
+
+class Worker(object):
+    '''Performance record of one worker'''
+    __slots__ = ('name', 'accepted', 'rejected', 'last_getwork', 'last_submit', 'submit_latency',
+                 'hashrate', 'hashrate_average', 'miner_id', 'hashrate_time')
+
+    def __init__(self, name):
+        self.name = name
+        self.accepted = 0
+        self.rejected = 0 # By pool or by proxy (stale, duplicate, invalid)
+        self.last_getwork = 0
+        self.last_submit = 0
+        self.submit_latency = 0.0 # Rolling average of share round trip to the pool, ms
+        self.hashrate = 0 # Last reported by miner, H/s
+        self.hashrate_average = 0.0 # Rolling average, H/s
+        self.miner_id = None
+        self.hashrate_time = 0
+
+    def add_result(self, accepted, latency):
+        if accepted:
+            self.accepted += 1
+        else:
+            self.rejected += 1
+        if self.submit_latency:
+            self.submit_latency += 0.1 * (latency-self.submit_latency)
+        else:
+            self.submit_latency = latency
+
+    def get_stats(self, now):
+        return {'accepted': self.accepted, 'rejected': self.rejected,
+                'last_getwork': int(now-self.last_getwork) if self.last_getwork else None,
+                'last_submit': int(now-self.last_submit) if self.last_submit else None,
+                'submit_latency': int(self.submit_latency),
+                'hashrate': self.hashrate, 'hashrate_average': int(self.hashrate_average)}
+
+class WorkerRegistry(object):
+    '''Workers by name with hard cap, least recently seen worker is evicted first'''
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.workers = OrderedDict()
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.workers)
+
+    def __iter__(self):
+        return self.workers.itervalues()
+
+    def get(self, name):
+        '''Return record of worker, create it when missing, mark it as recently seen'''
+        worker = self.workers.pop(name, None)
+        if worker == None:
+            worker = Worker(name)
+            if len(self.workers) >= self.max_workers:
+                self.workers.popitem(last=False)
+                self.evicted += 1
+        self.workers[name] = worker
+        return worker
+
+    def get_stats(self):
+        now = time.time()
+        return dict([ (worker.name, worker.get_stats(now)) for worker in self.workers.itervalues() ])
@@ -0,0 +1,73 @@
+'''JSON codec used for every line and HTTP body of the proxy.
+
+On import, the first available implementation in order of CANDIDATES
+(ujson, simplejson with C speedups, stdlib json) which encodes PROBES
+exactly like stdlib json and decodes them back to equal objects is used,
+so switching implementation never changes bytes on the wire. Output keeps
+stdlib default separators (space after ',' and ':'); ujson has no option
+for them, so it is skipped whenever its output differs.'''
+
+import json
+
+import logger
+log = logger.get_logger('codec')
+
+# Real messages of pool and miners, plus the corner cases which differ between libraries
+PROBES = [
+    {'id': 1, 'jsonrpc': '2.0', 'result': ['0x' + 'ab' * 32, '0x' + 'cd' * 32, '0x00000000' + 'f' * 56]},
+    {'id': 4, 'method': 'eth_submitWork', 'params': ['0x' + '12' * 8, '0x' + 'ab' * 32, '0x' + 'ef' * 32], 'jsonrpc': '2.0', 'worker': 'rig1'},
+    {'id': None, 'result': None, 'error': [-1, u'Escaped \u1234 "quotes" / slash \\ and\nnewline', None]},
+    {'id': 2, 'result': False, 'error': 'Stale share', 'list': [True, None, 0, -1, 2 ** 53, 1.5, 0.1]},
+]
+
+def _stdlib():
+    encoder = json.JSONEncoder()
+    decoder = json.JSONDecoder()
+    return (encoder.encode, decoder.decode)
+
+def _ujson():
+    import ujson
+    fallback = json.JSONEncoder().encode
+    def dumps(obj):
+        try:
+            return ujson.dumps(obj, ensure_ascii=True, escape_forward_slashes=False)
+        except OverflowError:
+            # Integers over 64 bits
+            return fallback(obj)
+    return (dumps, ujson.loads)
+
+def _simplejson():
+    import simplejson
+    if not simplejson._speedups:
+        raise ImportError("simplejson without C speedups")
+    encoder = simplejson.JSONEncoder()
+    decoder = simplejson.JSONDecoder()
+    return (encoder.encode, decoder.decode)
+
+CANDIDATES = [('ujson', _ujson), ('simplejson', _simplejson), ('json', _stdlib)] # Order of preference
+
+def is_compatible(dumps, loads):
+    (ref_dumps, ref_loads) = _stdlib()
+    try:
+        for probe in PROBES:
+            serialized = dumps(probe)
+            if serialized != ref_dumps(probe) or loads(serialized) != ref_loads(serialized):
+                return False
+    except Exception:
+        return False
+    return True
+
+def select():
+    '''Returns (name, dumps, loads) of first available codec compatible with stdlib json'''
+    for name, factory in CANDIDATES:
+        try:
+            (dumps, loads) = factory()
+        except (ImportError, AttributeError, TypeError):
+            continue
+        if not is_compatible(dumps, loads):
+            log.info("JSON codec %s produces different output than stdlib json, skipping it" % name)
+            continue
+        log.info("Using JSON codec %s" % name)
+        return (name, dumps, loads)
+
+(NAME, dumps, loads) = select()
@@ -32,9 +32,9 @@ THREAD_POOL_SIZE = 30
 #RPC_TIMEOUT_TOTAL = 600
 
 # RPC call throws TimeoutServiceException once client is processing request longer
-# than _PROCESS (in second)
-# NOT IMPLEMENTED YET
-#RPC_TIMEOUT_PROCESS = 30
+# than _PROCESS (in second), e.g. pool which doesn't answer eth_submitWork.
+# Late answer is ignored. 0 disables the timeout.
+RPC_TIMEOUT_PROCESS = 30
 
 # ******************** TRANSPORTS *********************
 
@@ -156,7 +156,7 @@ MONITORING_EMAIL = 'mail@example.com'
 POOL_HOST = 'eth-eu.dwarfpool.com'
 POOL_PORT = 8008
 
-# Failover pool.
+# Failover pools in priority order, more can be added as POOL_HOST_FAILOVER4, POOL_PORT_FAILOVER4 and so on
 POOL_FAILOVER_ENABLE = False
 POOL_HOST_FAILOVER1 = 'eth-ru.dwarfpool.com'
 POOL_PORT_FAILOVER1 = 8008
@@ -164,3 +164,106 @@ POOL_HOST_FAILOVER2 = 'eth-us.dwarfpool.com'
 POOL_PORT_FAILOVER2 = 8008
 POOL_HOST_FAILOVER3 = 'eth-hk.dwarfpool.com'
 POOL_PORT_FAILOVER3 = 8008
+
+# How active pool is picked among connected ones: 'priority' takes the first
+# one in order above, 'latency' the one with lowest smoothed ping round-trip
+# time plus job arrival lag (all pools are pinged every 5 seconds then).
+# Faster pool takes over only when it is faster by POOL_SWITCH_MARGIN ms
+# for POOL_SWITCH_DELAY seconds, so the proxy doesn't flap between pools.
+POOL_SELECTION = 'priority'
+POOL_SWITCH_MARGIN = 20
+POOL_SWITCH_DELAY = 60
+
+# Pool health checks. Every connected pool gets eth_getWork heartbeat each
+# POOL_HEARTBEAT_INTERVAL ms. Pool which drops connection or doesn't answer
+# within POOL_FAILOVER_TIMEOUT ms is down and the proxy fails over at once,
+# pool answering slower than half of the timeout or sending no new job for
+# POOL_JOB_TIMEOUT seconds (0 disables) is used only when no healthy pool is
+# left. POOL_FAILOVER_TIMEOUT = 0 disables heartbeats, then failover happens
+# on disconnect only and pools are pinged every 5s (failovers every 30s).
+# Heartbeats multiply requests to the pools, some pools rate-limit them.
+POOL_FAILOVER_TIMEOUT = 0
+POOL_HEARTBEAT_INTERVAL = 1000
+POOL_JOB_TIMEOUT = 120
+
+# Last job of every connected pool is kept. When another pool becomes active,
+# its job is given to miners at once if the pool sent it within WARM_JOB_MAX_AGE
+# seconds (heartbeat answers count), otherwise miners wait for its next job.
+WARM_JOB_MAX_AGE = 30
+
+# Lost pool is reconnected after POOL_RECONNECT_DELAY ms, delay grows up to
+# POOL_RECONNECT_MAX_DELAY seconds and is randomized, so restarted pool isn't
+# hit by all proxies at once. Connect attempt to failover pool gives up after
+# POOL_CONNECT_TIMEOUT seconds, main pool has 30 seconds as proxy quits when it
+# isn't reached on start.
+POOL_RECONNECT_DELAY = 100
+POOL_RECONNECT_MAX_DELAY = 10
+POOL_CONNECT_TIMEOUT = 5
+
+# Long polling for eth_getWork. Request carrying current header as first param
+# is answered once new job arrives or after timeout (in seconds).
+GETWORK_LONGPOLL = False
+GETWORK_LONGPOLL_TIMEOUT = 60
+
+# Port for stratum miners (EthProxy dialect: eth_submitLogin, eth_getWork,
+# eth_submitWork, eth_submitHashrate). New jobs are pushed to miners. 0 disables it.
+STRATUM_PORT = 0
+
+# Port for miners speaking EthereumStratum/1.0.0 (NiceHash dialect), 0 disables it.
+# Every miner gets its own extranonce prefix of ETHSTRATUM_EXTRANONCE_SIZE bytes.
+# Needs pyethash package to compute mix digest of submitted shares.
+ETHSTRATUM_PORT = 0
+ETHSTRATUM_EXTRANONCE_SIZE = 2
+
+# Max shares and hashrates waiting for upstream write. When queue is full,
+# new shares are refused and miners are told so.
+SUBMIT_QUEUE_SIZE = 1000
+
+# Shares whose pool is down wait in replay queue (at most REPLAY_QUEUE_SIZE,
+# oldest are dropped first) and are sent once the pool is back, unless they
+# are older than REPLAY_QUEUE_MAX_AGE seconds or their job went stale.
+# 0 size disables it, such shares are dropped at once.
+REPLAY_QUEUE_SIZE = 10000
+REPLAY_QUEUE_MAX_AGE = 60
+
+# Verdict of every share (accepted, rejected by pool, stale, duplicate, invalid
+# or lost during pool outage) is appended to binary journal in JOURNAL_DIR,
+# one file per day. Counters of workers are rebuilt from records of last
+# JOURNAL_RESTORE_AGE seconds on start. Read journal with tools/scan_journal.py
+# Files are never deleted, remove old ones yourself.
+SHARE_JOURNAL = False
+JOURNAL_DIR = 'journal/'
+JOURNAL_RESTORE_AGE = 86400
+
+# Submitted shares are remembered for this many seconds (per job),
+# duplicates are answered by proxy and never sent to the pool.
+DUPLICATE_SHARE_WINDOW = 600
+
+# Verify shares locally (ethash light evaluation) and drop invalid or
+# low difficulty ones before they reach the pool. Needs pyethash package.
+# Ethash caches are stored in ETHASH_CACHE_DIR and reused after restart.
+VERIFY_SHARES = False
+ETHASH_CACHE_DIR = 'ethash/'
+
+# Number of recent jobs remembered. Shares of job replaced more than
+# STALE_SHARE_WINDOW seconds ago (or of unknown job) are dropped as stale.
+RECENT_JOBS = 16
+STALE_SHARE_WINDOW = 30
+
+# Hashrates reported by miners are averaged by proxy and sent to the pool once
+# per HASHRATE_REPORT_INTERVAL seconds, for every worker ('worker') or as total
+# of whole farm ('farm'). Current values are on http://HOST:PORT/hashrate
+HASHRATE_REPORT_INTERVAL = 60
+HASHRATE_REPORT_MODE = 'worker'
+
+# Max number of worker records kept in memory, least recently seen worker is
+# evicted first. Stats of workers are on http://HOST:PORT/workers
+MAX_WORKERS = 10000
+
+# Serve miners on PORT from this many worker processes, 0 serves them from
+# main process. Workers share the port with SO_REUSEPORT (Linux 3.9+), get
+# jobs from main process and send shares back to it, so pool still sees one
+# connection. STRATUM_PORT and ETHSTRATUM_PORT stay in main process. Status
+# pages of PORT (/, /workers, /hashrate, /metrics, /health) come from main
+# process whichever worker answers.
+WORKER_PROCESSES = 0
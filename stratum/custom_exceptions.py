@@ -40,5 +40,8 @@ class FeeRequiredException(ServiceException):
 class TimeoutServiceException(ServiceException):
     pass
 
+class RejectedShareException(ServiceException):
+    pass
+
 class RemoteServiceException(Exception):
     pass
\ No newline at end of file
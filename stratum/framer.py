@@ -0,0 +1,50 @@
+'''Incremental splitting of a byte stream into lines.
+
+Twisted's LineOnlyReceiver joins buffered data with every read and splits
+the result again, so message which arrives in many TCP segments is copied
+and scanned once per segment, quadratic in its length. LineFramer keeps
+only the unfinished line, in a bytearray which grows in place, and scans
+each read once:
+
+  * lines of a read are split out of the read itself, the buffer is
+    copied only once, when its line is finished,
+  * buffer never holds a delimiter, so it is never searched again and
+    its length is the length of the unfinished line, checked in O(1).'''
+
+class LineFramer(object):
+
+    def __init__(self, delimiter='\n'):
+        if len(delimiter) != 1:
+            # Delimiter split between two reads would be missed
+            raise ValueError("LineFramer supports one byte delimiter only")
+        self.delimiter = delimiter
+        self.buffer = bytearray() # Unfinished line
+
+    def __len__(self):
+        '''Length of unfinished line'''
+        return len(self.buffer)
+
+    def feed(self, data):
+        '''Returns list of lines completed by data, without delimiter'''
+        lines = data.split(self.delimiter)
+        buffer = self.buffer
+        if buffer:
+            if len(lines) == 1:
+                # Another piece of long message
+                buffer += data
+                return []
+            # First piece finishes buffered line
+            buffer += lines[0]
+            lines[0] = str(buffer)
+            del buffer[:]
+        tail = lines.pop()
+        if tail:
+            buffer += tail
+        return lines
+
+    def tail(self):
+        '''Copy of unfinished line'''
+        return str(self.buffer)
+
+    def clear(self):
+        del self.buffer[:]
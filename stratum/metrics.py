@@ -0,0 +1,120 @@
+'''Counters and histograms exported in Prometheus text format.
+
+Children of labelled metrics are created once and kept by the caller
+(see SocketTransportClientFactory), so update on hot path is only
+an increment of preallocated slot, nothing is built per call.'''
+
+import bisect
+from array import array
+from collections import OrderedDict
+
+REGISTRY = OrderedDict() # name -> metric, in order of registration
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{%s}' % ','.join([ '%s="%s"' % (name, escape(value)) for name, value in zip(names, values) ])
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+class CounterValue(object):
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+class Counter(object):
+    '''Monotonic counter, optionally split by labels'''
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.children = OrderedDict() # label values -> CounterValue
+        self.value = 0
+        REGISTRY[name] = self
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def labels(self, *values):
+        '''Child counter for given label values, keep it instead of calling this on hot path'''
+        child = self.children.get(values)
+        if child == None:
+            child = self.children[values] = CounterValue()
+        return child
+
+    def samples(self):
+        if not self.label_names:
+            return [ (self.name, self.value) ]
+        return [ (self.name + format_labels(self.label_names, values), child.value)
+                 for values, child in self.children.iteritems() ]
+
+class Gauge(object):
+    '''Value read from callable when metrics are rendered, costs nothing between scrapes.
+    Use kind='counter' for totals which are already counted elsewhere.'''
+
+    def __init__(self, name, help, func, kind='gauge'):
+        self.name = name
+        self.help = help
+        self.func = func
+        self.kind = kind
+        REGISTRY[name] = self
+
+    def samples(self):
+        return [ (self.name, self.func()) ]
+
+class Histogram(object):
+    '''Histogram with fixed upper bounds, counts are kept in preallocated array'''
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.counts = array('L', [0] * (len(self.buckets)+1)) # Last one is +Inf
+        self.sum = array('d', [0.0])
+        REGISTRY[name] = self
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum[0] += value
+
+    def samples(self):
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append(('%s_bucket{le="%s"}' % (self.name, bound), total))
+        total += self.counts[-1]
+        result.append(('%s_bucket{le="+Inf"}' % self.name, total))
+        result.append(('%s_sum' % self.name, self.sum[0]))
+        result.append(('%s_count' % self.name, total))
+        return result
+
+def render():
+    '''All registered metrics in Prometheus text exposition format'''
+    lines = []
+    for metric in REGISTRY.itervalues():
+        lines.append('# HELP %s %s' % (metric.name, metric.help))
+        lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+        for name, value in metric.samples():
+            lines.append('%s %s' % (name, format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+# Metrics of pool connections, updated by protocol and socket_transport
+SUBMIT_RTT = Histogram('stratum_submit_rtt_seconds', 'Round trip of eth_submitWork to the pool',
+                       (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+POOL_SHARES = Counter('stratum_pool_shares_total', 'Shares answered by the pool', ('pool', 'result'))
+POOL_RECONNECTS = Counter('stratum_pool_reconnects_total', 'Reconnection attempts to the pool', ('pool',))
+POOL_RPC_TIMEOUTS = Counter('stratum_pool_rpc_timeouts_total', 'Requests not answered by the pool within RPC_TIMEOUT_PROCESS', ('pool',))
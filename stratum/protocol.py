@@ -1,4 +1,3 @@
-import json
 import time
 import socket
 
@@ -7,13 +6,32 @@ from twisted.internet import defer, reactor, error
 from twisted.python.failure import Failure
 
 import stats
+import codec
+import metrics
 import custom_exceptions
 import connection_registry
+import timer_wheel
+from framer import LineFramer
 import settings
 
 import logger
 log = logger.get_logger('protocol')
 
+# Expires RPC calls of all connections which weren't answered within settings.RPC_TIMEOUT_PROCESS
+rpc_timers = timer_wheel.TimerWheel()
+
+class PendingCall(object):
+    '''RPC request waiting for answer of the other side'''
+    __slots__ = ('defer', 'method', 'params', 'start_time', 'worker_name', 'timer')
+
+    def __init__(self, d, method, params, worker_name):
+        self.defer = d
+        self.method = method
+        self.params = params
+        self.start_time = time.time()
+        self.worker_name = worker_name
+        self.timer = None # Handle in rpc_timers
+
 class RequestCounter(object):
     def __init__(self):
         self.on_finish = defer.Deferred()
@@ -35,10 +53,15 @@ class Protocol(LineOnlyReceiver):
     delimiter = '\n'
     
     def _get_id(self):
-        self.request_id += 1
-        if self.request_id>65534:
-            self.request_id = 2
-        return self.request_id
+        # Ids of requests still waiting for answer are skipped, so answer can't complete wrong call
+        for _ in xrange(65533):
+            self.request_id += 1
+            if self.request_id>65534:
+                self.request_id = 2
+            if self.request_id not in self.lookup_table:
+                self.timed_out.discard(self.request_id)
+                return self.request_id
+        raise custom_exceptions.TransportException("Too many requests waiting for answer")
 
     def _get_ip(self):
         return self.proxied_ip or self.transport.getPeer().host
@@ -65,9 +88,11 @@ class Protocol(LineOnlyReceiver):
         # Read settings.TCP_PROXY_PROTOCOL documentation
         self.expect_tcp_proxy_protocol_header = self.factory.__dict__.get('tcp_proxy_protocol_enable', False)
         self.proxied_ip = None # IP obtained from TCP proxy protocol
+        self.framer = LineFramer(self.delimiter)
         
         self.request_id = 1
-        self.lookup_table = {}
+        self.lookup_table = {} # request id -> PendingCall
+        self.timed_out = set() # Ids of expired calls until they are used again, their answers are ignored
         self.event_handler = self.factory.event_handler()
         self.on_disconnect = defer.Deferred()
         self.on_finish = None # Will point to defer which is called
@@ -93,6 +118,12 @@ class Protocol(LineOnlyReceiver):
         if self.on_disconnect != None and not self.on_disconnect.called:
             self.on_disconnect.callback(self)
             self.on_disconnect = None
+
+        # Calls waiting for answer won't get one
+        (pending, self.lookup_table) = (self.lookup_table, {})
+        for request_id, call in pending.iteritems():
+            rpc_timers.cancel((self, request_id), call.timer)
+            call.defer.errback(custom_exceptions.TransportException("Connection lost"))
  
         stats.PeerStats.client_disconnected(self._get_ip())
         connection_registry.ConnectionRegistry.remove_connection(self)
@@ -100,7 +131,7 @@ class Protocol(LineOnlyReceiver):
  
     def writeJsonRequest(self, method, params, worker, is_notification=False):
         request_id = None if is_notification else self._get_id() 
-        serialized = json.dumps({'id': request_id, 'method': method, 'params': params, 'jsonrpc':'2.0', 'worker': worker})
+        serialized = codec.dumps({'id': request_id, 'method': method, 'params': params, 'jsonrpc':'2.0', 'worker': worker})
 
         if self.factory.debug:
             log.debug("< %s" % serialized)
@@ -111,7 +142,7 @@ class Protocol(LineOnlyReceiver):
     def writeJsonResponse(self, data, message_id):
         if not data:
             return
-        serialized = json.dumps({'id': message_id, 'result': data, 'error': None, 'jsonrpc':'2.0'})
+        serialized = codec.dumps({'id': message_id, 'result': data, 'error': None, 'jsonrpc':'2.0'})
 
         if self.factory.debug:
             log.debug("< %s" % serialized)
@@ -119,7 +150,7 @@ class Protocol(LineOnlyReceiver):
         self.transport_write("%s\n" % serialized)
 
     def writeJsonError(self, code, message, traceback, message_id):
-        serialized = json.dumps({'id': message_id, 'result': None, 'error': (code, message, traceback)})
+        serialized = codec.dumps({'id': message_id, 'result': None, 'error': (code, message, traceback)})
         self.transport_write("%s\n" % serialized)
 
     def writeGeneralError(self, message, code=-1):
@@ -152,6 +183,7 @@ class Protocol(LineOnlyReceiver):
         
     def dataReceived(self, data, request_counter=None):
         '''Original code from Twisted, hacked for request_counter proxying.
+        Lines are split by LineFramer, without copying data buffered by previous reads.
         request_counter is hack for HTTP transport, didn't found cleaner solution how
         to indicate end of request processing in asynchronous manner.
         
@@ -161,8 +193,7 @@ class Protocol(LineOnlyReceiver):
         if request_counter == None:
             request_counter = RequestCounter()
             
-        lines  = (self._buffer+data).split(self.delimiter)
-        self._buffer = lines.pop(-1)
+        lines = self.framer.feed(data)
         request_counter.set_count(len(lines))
         self.on_finish = request_counter.on_finish
 
@@ -182,9 +213,9 @@ class Protocol(LineOnlyReceiver):
                     log.warning("Failed message: %s from %s" % (str(exc), self._get_ip()))
                     return error.ConnectionLost('Processing of message failed')
                     
-        if len(self._buffer) > self.MAX_LENGTH:
+        if len(self.framer) > self.MAX_LENGTH:
             request_counter.finish()
-            return self.lineLengthExceeded(self._buffer)        
+            return self.lineLengthExceeded(self.framer.tail())
         
     def lineReceived(self, line, request_counter):
         if self.expect_tcp_proxy_protocol_header:
@@ -203,7 +234,7 @@ class Protocol(LineOnlyReceiver):
                 return
             
         try:
-            message = json.loads(line)
+            message = codec.loads(line)
         except:
             #self.writeGeneralError("Cannot decode message '%s'" % line)
             request_counter.finish()
@@ -220,7 +251,16 @@ class Protocol(LineOnlyReceiver):
                                         
         # If there's an error, handle it as errback
         if msg_error != None:
-            meta['defer'].errback(custom_exceptions.RemoteServiceException(msg_error))
+            request_counter.decrease()
+            if not msg_id:
+                log.warning("Error message from %s: %s" % (self._get_ip(), msg_error))
+                return
+            call = self.pop_call(msg_id)
+            if call != None:
+                if call.method == "eth_submitWork":
+                    self.factory.shares_rejected.inc()
+                    log.warning("[%dms] %s from '%s' REJECTED: %s" % ((time.time() - call.start_time) * 1000, call.method, call.worker_name, msg_error))
+                call.defer.errback(custom_exceptions.RemoteServiceException(msg_error))
             return
 
         if not msg_id:
@@ -239,21 +279,21 @@ class Protocol(LineOnlyReceiver):
             # Perform lookup to the table of waiting requests.
             request_counter.decrease()
            
-            try:
-                meta = self.lookup_table[msg_id]
-                if meta['method'] == "eth_submitWork":
-                    response_time = (time.time() - meta['start_time']) * 1000
-                    if msg_result == True:
-                        log.info("[%dms] %s from '%s' accepted" % (response_time, meta['method'], meta['worker_name']))
-                    else:
-                        log.warning("[%dms] %s from '%s' REJECTED" % (response_time, meta['method'], meta['worker_name']))
-                del self.lookup_table[msg_id]
-            except KeyError:
-                # When deferred object for given message ID isn't found, it's an error
-                raise custom_exceptions.ProtocolException("Lookup for deferred object for message ID '%s' failed." % msg_id)
+            call = self.pop_call(msg_id)
+            if call == None:
+                return
+            if call.method == "eth_submitWork":
+                response_time = (time.time() - call.start_time) * 1000
+                metrics.SUBMIT_RTT.observe(response_time / 1000)
+                if msg_result == True:
+                    self.factory.shares_accepted.inc()
+                    log.info("[%dms] %s from '%s' accepted" % (response_time, call.method, call.worker_name))
+                else:
+                    self.factory.shares_rejected.inc()
+                    log.warning("[%dms] %s from '%s' REJECTED" % (response_time, call.method, call.worker_name))
 
             # If both result and error are null, handle it as a success with blank result
-            meta['defer'].callback(msg_result)
+            call.defer.callback(msg_result)
             if not isinstance(msg_result, bool):
                 try:
                     result = self.event_handler._handle_event("eth_getWork", msg_result, connection_ref=self)
@@ -282,10 +322,35 @@ class Protocol(LineOnlyReceiver):
             return
 
         d = defer.Deferred()
-        start_time = time.time()
-        self.lookup_table[request_id] = {'defer': d, 'method': method, 'params': params, 'start_time':start_time, 'worker_name':worker}
+        call = self.lookup_table[request_id] = PendingCall(d, method, params, worker)
+        if settings.RPC_TIMEOUT_PROCESS:
+            call.timer = rpc_timers.add((self, request_id), settings.RPC_TIMEOUT_PROCESS, self.on_rpc_timeout, request_id)
         return d
 
+    def pop_call(self, msg_id):
+        '''Removes call of answer from lookup table, returns None for late answer of expired call'''
+        call = self.lookup_table.pop(msg_id, None)
+        if call != None:
+            rpc_timers.cancel((self, msg_id), call.timer)
+            return call
+        if msg_id in self.timed_out:
+            self.timed_out.discard(msg_id)
+            log.info("Answer for message ID '%s' came after timeout, ignored" % msg_id)
+            return None
+        # When deferred object for given message ID isn't found, it's an error
+        raise custom_exceptions.ProtocolException("Lookup for deferred object for message ID '%s' failed." % msg_id)
+
+    def on_rpc_timeout(self, request_id):
+        call = self.lookup_table.pop(request_id, None)
+        if call == None:
+            return
+        self.timed_out.add(request_id)
+        counter = getattr(self.factory, 'rpc_timeouts', None)
+        if counter != None:
+            counter.inc()
+        log.warning("%s from '%s' not answered within %ss" % (call.method, call.worker_name, settings.RPC_TIMEOUT_PROCESS))
+        call.defer.errback(custom_exceptions.TimeoutServiceException("%s not answered within %ss" % (call.method, settings.RPC_TIMEOUT_PROCESS)))
+
 class ClientProtocol(Protocol):
     def connectionMade(self):
         Protocol.connectionMade(self)
@@ -298,7 +363,7 @@ class ClientProtocol(Protocol):
         if isinstance(getattr(self.factory, 'after_connect', None), list):
             log.debug("Resuming connection: %s" % self.factory.after_connect)
             for cmd in self.factory.after_connect:
-                self.rpc(cmd[0], cmd[1], cmd[2])
+                self.rpc(cmd[0], cmd[1], cmd[2]).addErrback(self.on_after_connect_error, cmd[0])
 
         if not self.factory.on_connect.called:
             d = self.factory.on_connect 
@@ -308,6 +373,11 @@ class ClientProtocol(Protocol):
         #d = self.rpc('node.get_peers', [])
         #d.addCallback(self.factory.add_peers)
 
+    def on_after_connect_error(self, failure, method):
+        failure.trap(custom_exceptions.TransportException, custom_exceptions.TimeoutServiceException,
+                     custom_exceptions.RemoteServiceException)
+        log.warning("%s after connect failed: %s" % (method, failure.getErrorMessage()))
+
     def connectionLost(self, reason):
         self.factory.client = None
 
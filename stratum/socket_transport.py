@@ -4,6 +4,7 @@ from twisted.internet import reactor, defer, endpoints
 
 import socksclient
 import custom_exceptions
+import metrics
 from protocol import Protocol, ClientProtocol
 from event_handler import GenericEventHandler
 
@@ -30,9 +31,14 @@ class SocketTransportClientFactory(ReconnectingClientFactory):
     def __init__(self, host, port, allow_trusted=True, allow_untrusted=False,
                  debug=False, signing_key=None, signing_id=None,
                  is_reconnecting=True, proxy=None,
-                 event_handler=GenericEventHandler):
+                 event_handler=GenericEventHandler,
+                 connect_timeout=30, initial_delay=1.0, max_delay=60, jitter=ReconnectingClientFactory.jitter):
         self.debug = debug
-        self.maxDelay = 60
+        self.connect_timeout = connect_timeout
+        # Reconnect delay starts at initial_delay and grows up to max_delay, randomized by jitter
+        self.initialDelay = self.delay = initial_delay
+        self.maxDelay = max_delay
+        self.jitter = jitter
         self.is_reconnecting = is_reconnecting
         self.signing_key = signing_key
         self.signing_id = signing_id
@@ -51,17 +57,24 @@ class SocketTransportClientFactory(ReconnectingClientFactory):
         self.event_handler = event_handler
         self.protocol = ClientProtocol
         self.after_connect = []
+
+        # Metrics of this pool, labelled by address given on start
+        pool = "%s:%s" % (host, port)
+        self.shares_accepted = metrics.POOL_SHARES.labels(pool, 'accepted')
+        self.shares_rejected = metrics.POOL_SHARES.labels(pool, 'rejected')
+        self.reconnects = metrics.POOL_RECONNECTS.labels(pool)
+        self.rpc_timeouts = metrics.POOL_RPC_TIMEOUTS.labels(pool)
         
         self.connect()
         
     def connect(self):
         if self.proxy:
-            self.timeout_handler = reactor.callLater(60, self.connection_timeout)
+            self.timeout_handler = reactor.callLater(self.connect_timeout * 2, self.connection_timeout)
             sw = sockswrapper(self.proxy, self.main_host)
             sw.connect(self)
         else:
-            self.timeout_handler = reactor.callLater(30, self.connection_timeout)
-            reactor.connectTCP(self.main_host[0], self.main_host[1], self)
+            self.timeout_handler = reactor.callLater(self.connect_timeout, self.connection_timeout)
+            reactor.connectTCP(self.main_host[0], self.main_host[1], self, timeout=self.connect_timeout)
             
     '''
     This shouldn't be a part of transport layer
@@ -128,6 +141,7 @@ class SocketTransportClientFactory(ReconnectingClientFactory):
     def retry(self, connector=None):
         if not self.is_reconnecting:
             return
+        self.reconnects.inc()
 
         if connector is None:
             if self.connector is None:
@@ -0,0 +1,69 @@
+'''Hashed timer wheel for timeouts which are usually cancelled before they expire.
+
+Timer is stored in slot of its deadline tick (tick modulo number of slots),
+add and cancel are one dict operation and one LoopingCall serves every timer,
+instead of one reactor.callLater per request. Timers more than one turn of
+the wheel away stay in their slot until their tick comes. The loop runs only
+while some timer is pending.'''
+
+import time
+
+from twisted.internet import task
+
+import logger
+log = logger.get_logger('timer_wheel')
+
+class TimerWheel(object):
+
+    def __init__(self, tick=0.1, slots=512):
+        self.tick = tick # Seconds, timers expire up to one tick late
+        self.slots = [ {} for _ in xrange(slots) ] # key -> (deadline tick, callback, args)
+        self.current = int(time.time() / tick) # Last processed tick
+        self.count = 0
+        self.loop = task.LoopingCall(self.advance)
+
+    def __len__(self):
+        return self.count
+
+    def add(self, key, timeout, callback, *args):
+        '''Calls callback(*args) after timeout seconds unless cancel(key, handle) is called.
+        Key must be unique among pending timers, returns handle for cancel().'''
+        if not self.count:
+            # Wheel was idle, don't replay ticks which passed meanwhile
+            self.current = int(time.time() / self.tick)
+        handle = max(int((time.time() + timeout) / self.tick) + 1, self.current + 1)
+        self.slots[handle % len(self.slots)][key] = (handle, callback, args)
+        self.count += 1
+        if not self.loop.running:
+            self.loop.start(self.tick, now=False)
+        return handle
+
+    def cancel(self, key, handle):
+        if handle == None:
+            return
+        if self.slots[handle % len(self.slots)].pop(key, None) != None:
+            self.count -= 1
+
+    def advance(self):
+        now = int(time.time() / self.tick)
+        # After long stall (e.g. blocked reactor) every slot is visited once
+        ticks = min(now - self.current, len(self.slots))
+        self.current = now
+        expired = []
+        for tick in xrange(now - ticks + 1, now + 1):
+            slot = self.slots[tick % len(self.slots)]
+            if not slot:
+                continue
+            for key, timer in slot.items():
+                if timer[0] <= now:
+                    del slot[key]
+                    expired.append(timer)
+        self.count -= len(expired)
+        for (handle, callback, args) in expired:
+            try:
+                callback(*args)
+            except Exception:
+                log.exception("Timer callback failed")
+        # Callbacks may add new timers
+        if not self.count and self.loop.running:
+            self.loop.stop()
@@ -0,0 +1,171 @@
+'''Pool failover against two fake pools, run by: python -m unittest discover tests
+
+Reactor can't be restarted, so the proxy runs in a child process: this file
+started with 'scenario' argument wires main() of eth-proxy.py to two in-reactor fake pools
+(tools/fake_pool.py), submits shares through JobRegistry while the main pool
+goes down and goes silent, and prints seconds until shares are accepted by the
+failover pool and by the main pool again. tools/bench_failover.py measures the
+same switch over many rounds.'''
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+OUTAGES = ('down', 'silent')
+FAILOVER_TIMEOUT = 1000 # POOL_FAILOVER_TIMEOUT, ms
+HEARTBEAT = 250 # POOL_HEARTBEAT_INTERVAL, ms
+MAX_WAIT = 20 # Seconds, step of scenario fails after it
+SHARE_INTERVAL = 0.05 # Seconds between shares of the scenario
+
+def get_free_ports(count):
+    import socket
+    sockets = [ socket.socket() for _ in xrange(count) ]
+    for sock in sockets:
+        sock.bind(('127.0.0.1', 0))
+    ports = [ sock.getsockname()[1] for sock in sockets ]
+    for sock in sockets:
+        sock.close()
+    return ports
+
+def run_scenario():
+    '''Prints JSON {outage: {'failover': seconds, 'reinstated': seconds}}, None when step failed'''
+    sys.path.insert(0, os.path.join(ROOT_DIR, 'tools'))
+    sys.path.insert(0, ROOT_DIR)
+    root_dir = os.path.abspath(ROOT_DIR)
+    # No eth-proxy.conf, defaults of config_default are used and nothing is written into the tree
+    work_dir = tempfile.mkdtemp()
+    os.chdir(work_dir)
+
+    import imp
+    import time
+    import logging
+
+    from twisted.internet import reactor, defer, task
+
+    from stratum import settings
+    from stratum import custom_exceptions
+    from mining_libs import client_service
+    import fake_pool
+
+    ports = get_free_ports(2)
+    settings.COIN = 'ETH' # Given only by eth-proxy.conf
+    settings.HOST = '127.0.0.1'
+    settings.PORT = 0
+    settings.STRATUM_PORT = 0
+    settings.ETHSTRATUM_PORT = 0
+    settings.WORKER_PROCESSES = 0
+    settings.CUSTOM_EMAIL = ''
+    settings.SHARE_JOURNAL = False
+    settings.POOL_HOST = '127.0.0.1'
+    settings.POOL_PORT = ports[0]
+    settings.POOL_FAILOVER_ENABLE = True
+    for name in dir(settings):
+        if name.startswith('POOL_HOST_FAILOVER'):
+            setattr(settings, name, '')
+    settings.POOL_HOST_FAILOVER1 = '127.0.0.1'
+    settings.POOL_PORT_FAILOVER1 = ports[1]
+    settings.POOL_SELECTION = 'priority'
+    settings.POOL_FAILOVER_TIMEOUT = FAILOVER_TIMEOUT
+    settings.POOL_HEARTBEAT_INTERVAL = HEARTBEAT
+    settings.POOL_RECONNECT_MAX_DELAY = 1
+
+    eth_proxy = imp.load_source('eth_proxy', os.path.join(root_dir, 'eth-proxy.py'))
+    logging.getLogger('proxy').setLevel(logging.ERROR)
+    logging.getLogger('stats').setLevel(logging.ERROR)
+    # main() disconnects everything in reactor, pools must start after it
+    eth_proxy.main()
+    pools = []
+    for number in xrange(2):
+        pool = fake_pool.FakePool(fake_pool.FakePoolFactory(seed=number), ports[number])
+        pool.start()
+        pools.append(pool)
+
+    nonces = iter(xrange(1, 2**32))
+
+    def submit_share():
+        job_registry = client_service.ClientMiningService.job_registry
+        if not job_registry.jobs:
+            return
+        params = ['0x%016x' % nonces.next(), job_registry.jobs.params[0], '0x%064x' % 0]
+        try:
+            job_registry.submit('eth_submitWork', params, 'rig1')
+        except custom_exceptions.ServiceException:
+            pass
+
+    @defer.inlineCallbacks
+    def accepted_by(pool, timeout):
+        '''Seconds until pool accepts share, None on timeout'''
+        start = time.time()
+        accepted = pool.factory.stats['accepted']
+        while pool.factory.stats['accepted'] == accepted:
+            if time.time()-start > timeout:
+                defer.returnValue(None)
+            submit_share()
+            yield task.deferLater(reactor, SHARE_INTERVAL, lambda: None)
+        defer.returnValue(time.time() - start)
+
+    @defer.inlineCallbacks
+    def run():
+        results = {}
+        try:
+            if (yield accepted_by(pools[0], MAX_WAIT)) == None:
+                return
+            for outage in OUTAGES:
+                if outage == 'down':
+                    pools[0].go_down()
+                else:
+                    pools[0].go_silent()
+                failover = yield accepted_by(pools[1], MAX_WAIT)
+                pools[0].come_up()
+                reinstated = yield accepted_by(pools[0], MAX_WAIT)
+                results[outage] = {'failover': failover, 'reinstated': reinstated}
+                if reinstated == None:
+                    return
+        finally:
+            print json.dumps(results)
+            reactor.stop()
+
+    reactor.callWhenRunning(run)
+    reactor.run()
+    shutil.rmtree(work_dir)
+
+class FailoverTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__), 'scenario'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        (stdout, stderr) = process.communicate()
+        try:
+            cls.results = json.loads(stdout.strip().splitlines()[-1])
+        except (ValueError, IndexError):
+            raise AssertionError("Failover scenario didn't finish:\n%s" % stderr)
+
+    def assertWithin(self, outage, step, bound):
+        seconds = self.results.get(outage, {}).get(step)
+        self.assertNotEqual(seconds, None, "%s: no %s within %ds" % (outage, step, MAX_WAIT))
+        self.assertLess(seconds, bound, "%s: %s took %.1fs" % (outage, step, seconds))
+
+    def test_shares_move_to_failover_on_disconnect(self):
+        # Pool loss is seen at once, only login to failover pool is waited for
+        self.assertWithin('down', 'failover', 5)
+
+    def test_shares_move_to_failover_on_heartbeat_timeout(self):
+        # Silent pool keeps the connection, heartbeat has to miss POOL_FAILOVER_TIMEOUT
+        self.assertWithin('silent', 'failover', FAILOVER_TIMEOUT / 1000.0 + 5)
+
+    def test_main_pool_reinstated(self):
+        for outage in OUTAGES:
+            # Reconnect after backoff of POOL_RECONNECT_MAX_DELAY and heartbeats of recovered pool
+            self.assertWithin(outage, 'reinstated', 10)
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['scenario']:
+        run_scenario()
+    else:
+        unittest.main()
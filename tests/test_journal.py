@@ -0,0 +1,69 @@
+'''Share journal recovery, run by: python -m unittest discover tests'''
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mining_libs'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from twisted.internet import defer
+
+import journal
+import workers
+
+HEADER = "0x%064x" % 0x1234
+
+class ShareJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def records(self, count, worker_name):
+        return [ journal.pack(time.time(), 10.0, 0, journal.ACCEPTED, "0x%016x" % n, HEADER, worker_name) for n in xrange(count) ]
+
+    def restore(self):
+        registry = workers.WorkerRegistry(1000)
+        return (journal.ShareJournal(self.dir).restore(registry, 3600), registry)
+
+    def test_cut_record_followed_by_appends(self):
+        journal.ShareJournal(self.dir).write(self.records(5, 'rig1'))
+        # Crash in the middle of record
+        fp = open(journal.get_path(self.dir, time.time()), 'ab')
+        fp.write(self.records(1, 'rig1')[0][:20])
+        fp.close()
+
+        # Restarted proxy appends to the same file
+        journal.ShareJournal(self.dir).write(self.records(7, 'rig2'))
+
+        (count, registry) = self.restore()
+        self.assertEqual(count, 12)
+        self.assertEqual(sorted(registry.workers), ['rig1', 'rig2'])
+        self.assertEqual(registry.get('rig2').accepted, 7)
+
+    def test_processes_write_own_files(self):
+        journal.ShareJournal(self.dir).write(self.records(3, 'rig1'))
+        journal.ShareJournal(self.dir, suffix='-w0').write(self.records(4, 'rig2'))
+        self.assertEqual(len(journal.get_day_paths(self.dir, time.time())), 2)
+        self.assertEqual(self.restore()[0], 7)
+
+    def test_stop_waits_for_write_in_progress(self):
+        share_journal = journal.ShareJournal(self.dir)
+        share_journal.writing = defer.Deferred()
+        share_journal.buffer = self.records(2, 'rig1')
+        done = share_journal.stop()
+        self.assertFalse(done.called)
+        self.assertEqual(self.restore()[0], 0)
+
+        share_journal.writing.callback(None)
+        self.assertTrue(done.called)
+        self.assertEqual(self.restore()[0], 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+'''WORKER_PROCESSES mode without processes, run by: python -m unittest discover tests
+
+Master side (WorkerPool) and worker side (WorkerJobRegistry, MasterChannel)
+are wired by their IPC messages in one process.'''
+
+import os
+import sys
+import json
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mining_libs'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from twisted.test.proto_helpers import StringTransport
+from twisted.web.server import NOT_DONE_YET
+from twisted.web.test.requesthelper import DummyRequest
+
+from stratum import settings
+settings.COIN = getattr(settings, 'COIN', 'ETH') # Given only by eth-proxy.conf
+settings.SHARE_JOURNAL = False
+settings.VERIFY_SHARES = False
+
+from stratum import custom_exceptions
+import jobs
+import processes
+
+JOB = ["0x%064x" % 0x1234, "0x%064x" % 0, "0x%064x" % (2**256 // 4000000000)]
+MIX_DIGEST = "0x%064x" % 0x5678
+
+class WorkerModeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.master = jobs.JobRegistry([])
+        self.pool = processes.WorkerPool(self.master, 1)
+        self.process = processes.WorkerProcess(self.pool, 0)
+        self.process.transport = StringTransport()
+
+        self.channel = processes.MasterChannel()
+        self.channel.makeConnection(StringTransport())
+        self.worker = processes.WorkerJobRegistry(self.channel)
+        self.channel.job_registry = self.worker
+        self.worker.install_job(jobs.Job.build_from_pool(JOB))
+
+    def tearDown(self):
+        for queue in (self.master.submit_queue, self.worker.submit_queue):
+            if queue.drain_call and queue.drain_call.active():
+                queue.drain_call.cancel()
+
+    def sent_by_worker(self):
+        '''Messages of worker process to master since last call'''
+        lines = self.channel.transport.value().splitlines()
+        self.channel.transport.clear()
+        return [ json.loads(line) for line in lines ]
+
+    def deliver(self):
+        for message in self.sent_by_worker():
+            self.pool.handle_message(self.process, message['method'], message['params'])
+
+    def submit(self, nonce, header=JOB[0]):
+        try:
+            self.worker.submit('eth_submitWork', ["0x%016x" % nonce, header, MIX_DIGEST], 'rig1')
+        except custom_exceptions.RejectedShareException:
+            pass
+
+    def get_page(self, path):
+        '''Page as served by miner port of worker process'''
+        request = DummyRequest([path[1:]])
+        request.path = path
+        self.assertEqual(processes.WorkerRoot(self.worker, False).render_GET(request), NOT_DONE_YET)
+        self.deliver()
+        for line in self.process.transport.value().splitlines():
+            self.channel.lineReceived(line)
+        self.process.transport.clear()
+        self.assertTrue(request.finished)
+        return ''.join(request.written)
+
+    def test_refused_shares_counted_by_master(self):
+        self.submit(1)
+        self.submit(1) # Duplicate
+        self.submit(2, header="0x%064x" % 0xdead) # Stale
+        self.worker.send_stats()
+        self.deliver()
+
+        self.assertEqual((self.master.fresh_shares, self.master.stale_shares, self.master.share_index.duplicates), (1, 1, 1))
+        self.assertEqual(self.master.workers.get('rig1').rejected, 2)
+        # Counters of worker start from zero, nothing is counted twice
+        self.assertEqual((self.worker.fresh_shares, self.worker.stale_shares, self.worker.share_index.duplicates), (0, 0, 0))
+        self.worker.send_stats()
+        self.assertEqual(self.sent_by_worker(), [])
+
+    def test_status_pages_come_from_master(self):
+        self.master.workers.get('rig1').accepted = 5 # Pool verdicts are known to master only
+        self.submit(1, header="0x%064x" % 0xdead)
+        self.worker.send_stats()
+        self.deliver()
+
+        stats = json.loads(self.get_page('/workers'))
+        self.assertEqual((stats['rig1']['accepted'], stats['rig1']['rejected']), (5, 1))
+        self.assertIn("1 stale", self.get_page('/'))
+        self.assertIn("ethproxy_shares_stale_total 1", self.get_page('/metrics'))
+
+if __name__ == '__main__':
+    unittest.main()
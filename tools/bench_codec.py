@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+'''
+    Micro-benchmark of JSON codecs known to stratum.codec on real proxy payloads.
+
+    Every installed codec is measured, including ones which stratum.codec
+    refuses because their output differs from stdlib json. The codec picked
+    by the proxy is marked with "*".
+
+    Usage: python tools/bench_codec.py [iterations]
+'''
+
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from stratum import codec
+
+HEADER = "0x%064x" % 0x1234567890abcdef1234567890abcdef
+SEED = "0x%064x" % 0xfedcba
+BOUNDARY = "0x%064x" % (2**256 // 4000000000)
+
+PAYLOADS = [
+    # Pool pushes new job, miner polls it
+    ('getwork response', {'id': 0, 'jsonrpc': '2.0', 'result': [HEADER, SEED, BOUNDARY]}),
+    ('getwork request', {'id': 73, 'jsonrpc': '2.0', 'method': 'eth_getWork', 'params': []}),
+    # Miner submits share, proxy forwards it and pool answers
+    ('submitWork request', {'id': 40, 'jsonrpc': '2.0', 'method': 'eth_submitWork', 'worker': 'rig1',
+                            'params': ['0x%016x' % 0x1f2e3d4c5b6a7988, HEADER, "0x%064x" % 0xabcdef0123456789]}),
+    ('submitWork response', {'id': 40, 'jsonrpc': '2.0', 'result': True, 'error': None}),
+    ('submitHashrate request', {'id': 6, 'jsonrpc': '2.0', 'method': 'eth_submitHashrate', 'worker': 'rig1',
+                                'params': ['0x%x' % 180000000, "0x%064x" % 0x59daa26581d0acd1fce254fb7e85952f]}),
+]
+
+def measure(func, arg, iterations):
+    start = time.time()
+    for _ in xrange(iterations):
+        func(arg)
+    return iterations / (time.time() - start)
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    print "Codec used by proxy: %s" % codec.NAME
+    for name, factory in codec.CANDIDATES:
+        try:
+            (dumps, loads) = factory()
+        except (ImportError, AttributeError, TypeError):
+            print "\n%s: not installed" % name
+            continue
+
+        compatible = codec.is_compatible(dumps, loads)
+        print "\n%s %s%s" % (name, "*" if name == codec.NAME else "", "" if compatible else "(output differs from stdlib, not used)")
+        for title, payload in PAYLOADS:
+            serialized = dumps(payload)
+            print "  %-24s encode %9.0f/s   decode %9.0f/s" % (title, measure(dumps, payload, iterations), measure(loads, serialized, iterations))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+'''
+    Measures time-to-failover of the proxy against two local fake pools.
+
+    The proxy is wired by main() of eth-proxy.py, with main pool and one
+    failover pool pointed to fake pools (tools/fake_pool.py) in this process.
+    Every round breaks the main pool and measures how long it takes until
+    failover pool is active and until miners get job of failover pool, then
+    brings main pool back and waits until the proxy returns to it.
+
+    Outages:
+      down    main pool closes all connections and refuses new ones
+      silent  main pool keeps connections open but stops answering (hung server)
+
+    Usage: python tools/bench_failover.py [--rounds 5] [--failover-timeout 3000] [--heartbeat 1000]
+'''
+
+import os
+import sys
+import imp
+import time
+import logging
+import argparse
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from twisted.internet import reactor, defer, task
+
+from stratum import settings
+from mining_libs import client_service
+import fake_pool
+
+OUTAGES = ('down', 'silent')
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values)-1, int(fraction * len(values)))]
+
+@defer.inlineCallbacks
+def wait_for(condition, timeout, step=0.001):
+    '''Returns seconds until condition() is true, None on timeout'''
+    start = time.time()
+    while not condition():
+        if time.time()-start > timeout:
+            defer.returnValue(None)
+        yield task.deferLater(reactor, step, lambda: None)
+    defer.returnValue(time.time() - start)
+
+def configure(args):
+    settings.HOST = '127.0.0.1'
+    settings.PORT = 0
+    settings.STRATUM_PORT = 0
+    settings.ETHSTRATUM_PORT = 0
+    settings.WORKER_PROCESSES = 0
+    settings.CUSTOM_EMAIL = ''
+    settings.SHARE_JOURNAL = False
+    settings.POOL_HOST = '127.0.0.1'
+    settings.POOL_PORT = args.port
+    settings.POOL_FAILOVER_ENABLE = True
+    for name in dir(settings):
+        if name.startswith('POOL_HOST_FAILOVER'):
+            setattr(settings, name, '')
+    settings.POOL_HOST_FAILOVER1 = '127.0.0.1'
+    settings.POOL_PORT_FAILOVER1 = args.port + 1
+    settings.POOL_SELECTION = 'priority'
+    settings.POOL_FAILOVER_TIMEOUT = args.failover_timeout
+    settings.POOL_HEARTBEAT_INTERVAL = args.heartbeat
+
+@defer.inlineCallbacks
+def run(args, pools):
+    job_registry = client_service.ClientMiningService.job_registry
+    is_on = lambda pool_number: lambda: (job_registry.active_pool and job_registry.active_pool.pool_number == pool_number and
+                                         job_registry.jobs and job_registry.jobs.pool == pool_number)
+
+    if (yield wait_for(is_on(0), 30)) == None:
+        print "Proxy didn't start on main pool"
+        reactor.stop()
+        return
+
+    results = {}
+    for outage in OUTAGES:
+        results[outage] = ([], [])
+        for number in xrange(args.rounds):
+            # Let heartbeats settle after previous round
+            yield task.deferLater(reactor, args.pause, lambda: None)
+
+            start = time.time()
+            if outage == 'down':
+                pools[0].go_down()
+            else:
+                pools[0].go_silent()
+            switched = yield wait_for(lambda: job_registry.active_pool and job_registry.active_pool.pool_number == 1, args.max_wait)
+            has_job = yield wait_for(is_on(1), max(args.max_wait-(time.time()-start), 0))
+            if switched == None or has_job == None:
+                print "  %-6s round %d: no failover in %ds" % (outage, number+1, args.max_wait)
+            else:
+                job = time.time() - start
+                results[outage][0].append(switched)
+                results[outage][1].append(job)
+                print "  %-6s round %d: active pool switched after %.0fms, failover job after %.0fms" % (outage, number+1, switched*1000, job*1000)
+
+            pools[0].come_up()
+            if (yield wait_for(is_on(0), args.max_wait)) == None:
+                print "Proxy didn't return to main pool"
+                break
+
+    print "\nfailover timeout %dms, heartbeat %dms, %d rounds" % (args.failover_timeout, args.heartbeat, args.rounds)
+    for outage in OUTAGES:
+        (switches, jobs) = results[outage]
+        if switches:
+            print "  %-6s switch p50 %6.0fms max %6.0fms   job p50 %6.0fms max %6.0fms" % (outage,
+                  percentile(switches, 0.5)*1000, max(switches)*1000, percentile(jobs, 0.5)*1000, max(jobs)*1000)
+        else:
+            print "  %-6s no failover" % outage
+    reactor.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="Time-to-failover of eth-proxy against local fake pools")
+    parser.add_argument('--port', type=int, default=13400, help="main fake pool, failover uses port+1")
+    parser.add_argument('--rounds', type=int, default=5, help="outages of every kind")
+    parser.add_argument('--failover-timeout', type=int, default=settings.POOL_FAILOVER_TIMEOUT or 3000, help="POOL_FAILOVER_TIMEOUT, ms")
+    parser.add_argument('--heartbeat', type=int, default=settings.POOL_HEARTBEAT_INTERVAL, help="POOL_HEARTBEAT_INTERVAL, ms")
+    parser.add_argument('--job-interval', type=float, default=15, help="seconds between jobs of fake pools")
+    parser.add_argument('--pause', type=float, default=2, help="seconds between rounds")
+    parser.add_argument('--max-wait', type=float, default=60, help="round fails after this many seconds")
+    args = parser.parse_args()
+
+    configure(args)
+    eth_proxy = imp.load_source('eth_proxy', os.path.join(ROOT_DIR, 'eth-proxy.py'))
+    # Proxy logs every pool change, keep only the results on screen
+    logging.getLogger('proxy').setLevel(logging.ERROR)
+    logging.getLogger('stats').setLevel(logging.ERROR)
+    # main() disconnects everything in reactor, pools must start after it
+    eth_proxy.main()
+
+    pools = []
+    for number in xrange(2):
+        pool = fake_pool.FakePool(fake_pool.FakePoolFactory(seed=number), args.port + number)
+        pool.start()
+        task.LoopingCall(pool.factory.new_job).start(args.job_interval, now=False)
+        pools.append(pool)
+
+    reactor.callWhenRunning(run, args, pools)
+    reactor.run()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+'''
+    Micro-benchmark of line framing in stratum.protocol on pool and miner traffic.
+
+    stratum.framer.LineFramer is compared with the join+split framing of
+    Twisted's LineOnlyReceiver, which Protocol used before. Every stream is
+    cut into reads the way TCP delivers it and both framers must return the
+    same lines, so the benchmark is also a check of LineFramer.
+
+    Streams:
+      coalesced   many short messages per read (busy pool connection)
+      one/read    one message per read (idle miner)
+      pipelined   answers to pipelined eth_submitWork, reads cut at random offsets
+      fragmented  large message in TCP segments (e.g. long job list of a pool)
+
+    Usage: python tools/bench_framer.py [--rounds 5] [--size 262144]
+'''
+
+import os
+import sys
+import time
+import random
+import argparse
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from stratum.framer import LineFramer
+
+HEADER = "0x%064x" % 0x1234567890abcdef1234567890abcdef
+SEED = "0x%064x" % 0xfedcba
+BOUNDARY = "0x%064x" % (2**256 // 4000000000)
+JOB = '{"id":0,"jsonrpc":"2.0","result":["%s","%s","%s"]}\n' % (HEADER, SEED, BOUNDARY)
+ANSWER = '{"id":%d,"jsonrpc":"2.0","result":true,"error":null}\n'
+SEGMENT = 1448 # TCP payload of 1500 bytes MTU
+
+class JoinSplitFramer(object):
+    '''Framing of Protocol.dataReceived before LineFramer'''
+    def __init__(self, delimiter='\n'):
+        self.delimiter = delimiter
+        self._buffer = ''
+
+    def feed(self, data):
+        lines = (self._buffer+data).split(self.delimiter)
+        self._buffer = lines.pop(-1)
+        return lines
+
+def cut(stream, size):
+    return [ stream[i:i+size] for i in xrange(0, len(stream), size) ]
+
+def cut_random(stream, max_size, rnd):
+    reads = []
+    start = 0
+    while start < len(stream):
+        end = start + rnd.randint(1, max_size)
+        reads.append(stream[start:end])
+        start = end
+    return reads
+
+def build_streams(size):
+    rnd = random.Random(1)
+    answers = ''.join([ ANSWER % (number+2) for number in xrange(20000) ])
+    jobs = JOB * 5000
+    large = '{"id":0,"jsonrpc":"2.0","result":[%s]}\n' % ','.join([ '"%s"' % HEADER ] * (size // 69))
+    return [
+        ('coalesced 64k reads', cut(jobs, 65536)),
+        ('coalesced segments', cut(jobs, SEGMENT)),
+        ('one/read', [ ANSWER % (number+2) for number in xrange(20000) ]),
+        ('pipelined random cuts', cut_random(answers, 2 * SEGMENT, rnd)),
+        ('fragmented %dk segments' % (len(large) // 1024), cut(large, SEGMENT) * 4),
+        ('fragmented %dk 16k reads' % (len(large) // 1024), cut(large, 16384) * 4),
+    ]
+
+def measure(framer_class, reads, rounds):
+    '''Returns (best seconds of one pass, lines of last pass)'''
+    best = None
+    for _ in xrange(rounds):
+        framer = framer_class('\n')
+        feed = framer.feed
+        lines = []
+        start = time.time()
+        for data in reads:
+            lines.extend(feed(data))
+        duration = time.time() - start
+        best = duration if best == None else min(best, duration)
+    return (best, lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Line framing of stratum.protocol, LineFramer against join+split")
+    parser.add_argument('--rounds', type=int, default=5, help="best of N passes is reported")
+    parser.add_argument('--size', type=int, default=256*1024, help="bytes of fragmented message")
+    args = parser.parse_args()
+
+    print "%-28s %7s %8s %14s %14s %8s" % ("stream", "reads", "lines", "join+split", "LineFramer", "speedup")
+    for (name, reads) in build_streams(args.size):
+        (old_time, old_lines) = measure(JoinSplitFramer, reads, args.rounds)
+        (new_time, new_lines) = measure(LineFramer, reads, args.rounds)
+        if old_lines != new_lines:
+            print "%-28s LineFramer returned different lines!" % name
+            sys.exit(1)
+        print "%-28s %7d %8d %12.2fms %12.2fms %7.1fx" % (name, len(reads), len(new_lines),
+                                                       old_time * 1000, new_time * 1000, old_time / new_time if new_time else 0.0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+'''
+    Micro-benchmark of eth_getWork polls served by getwork_listener.Root.
+
+    Compares the legacy path (json.dumps of whole response on every poll)
+    with the pre-serialized response cache filled by JobRegistry.install_job().
+
+    Usage: python tools/bench_getwork.py [polls]
+'''
+
+import os
+import sys
+import time
+import json
+from StringIO import StringIO
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from mining_libs import getwork_listener
+from mining_libs import jobs
+
+JOB = ["0x%064x" % 0x1234567890abcdef, "0x%064x" % 0xfedcba, "0x%064x" % (2**256 // 4000000000)]
+POLL = json.dumps({"jsonrpc": "2.0", "method": "eth_getWork", "params": [], "id": 73})
+
+class FakePool(object):
+    is_connected = True
+    pool_number = 0
+    remote_ip = '127.0.0.1'
+
+class FakeRequest(object):
+    uri = '/rig1'
+
+    def __init__(self, body):
+        self.content = StringIO(body)
+
+    def setHeader(self, name, value):
+        pass
+
+    def getClientIP(self):
+        return '127.0.0.1'
+
+    def write(self, data):
+        pass
+
+    def finish(self):
+        pass
+
+def run(root, polls):
+    start = time.time()
+    for _ in xrange(polls):
+        root.render_POST(FakeRequest(POLL))
+    return polls / (time.time() - start)
+
+def main():
+    polls = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    job_registry = jobs.JobRegistry([FakePool()])
+    job_registry.install_job(jobs.Job.build_from_pool(JOB))
+    root = getwork_listener.Root(job_registry, False)
+
+    # Both paths must produce the same document
+    assert json.loads(job_registry.getwork_response(73)) == json.loads(root.json_response(73, JOB))
+
+    cached = run(root, polls)
+
+    # Legacy behaviour: serialize whole response on every poll
+    job_registry.getwork_response = lambda msg_id: root.json_response(msg_id, job_registry.jobs.params)
+    legacy = run(root, polls)
+
+    print "eth_getWork polls: %d" % polls
+    print "legacy json.dumps per poll: %10.0f polls/s" % legacy
+    print "pre-serialized cache:       %10.0f polls/s (x%.2f)" % (cached, cached / legacy)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+'''
+    Local stand-in for an Ethereum stratum pool (EthProxy dialect, like dwarfpool).
+
+    Answers eth_submitLogin, eth_getWork, eth_submitWork and eth_submitHashrate
+    and pushes new jobs as {"id":0,"result":[header, seed, boundary]}.
+    Job cadence, response latency, reject ratio and disconnect schedule are
+    configurable and random choices come from --seed, so runs are repeatable.
+
+    Point proxy at it with POOL_HOST = "127.0.0.1" and POOL_PORT = <port>,
+    failover pools are just more instances on other ports.
+
+    Usage: python tools/fake_pool.py [--port 3333] [--job-interval 15] [--latency 20] [--reject-ratio 0.01]
+
+    FakePoolFactory can be imported by other tools to drive the pool from code.
+'''
+
+import sys
+import time
+import json
+import random
+import hashlib
+import argparse
+from collections import deque
+
+from twisted.internet import reactor, protocol, task
+from twisted.protocols.basic import LineOnlyReceiver
+
+SEED_HASH = "0x%064x" % 0
+BOUNDARY = "0x%064x" % (2**256 // 4000000000)
+
+class PoolProtocol(LineOnlyReceiver):
+    delimiter = '\n'
+    MAX_LENGTH = 64 * 1024
+
+    def connectionMade(self):
+        self.factory.clients.add(self)
+        self.factory.stats['connections'] += 1
+        try:
+            self.transport.setTcpNoDelay(True)
+        except Exception:
+            pass
+
+    def connectionLost(self, reason):
+        self.factory.clients.discard(self)
+
+    def lineReceived(self, line):
+        if self.factory.silent:
+            return
+        try:
+            message = json.loads(line)
+            (msg_id, method, params) = (message.get('id'), message['method'], message.get('params') or [])
+        except (ValueError, KeyError, AttributeError):
+            self.factory.stats['bad_requests'] += 1
+            return
+
+        if method == 'eth_submitLogin':
+            result = True
+        elif method == 'eth_getWork':
+            result = self.factory.job
+        elif method == 'eth_submitWork':
+            result = self.factory.check_share(params)
+        elif method == 'eth_submitHashrate':
+            self.factory.stats['hashrates'] += 1
+            result = True
+        else:
+            self.respond(msg_id, None, [-3, "Method not found", None])
+            return
+        self.respond(msg_id, result)
+
+    def respond(self, msg_id, result, error=None):
+        line = json.dumps({'id': msg_id, 'jsonrpc': '2.0', 'result': result, 'error': error}) + '\n'
+        delay = self.factory.get_latency()
+        if delay:
+            reactor.callLater(delay, self.write, line)
+        else:
+            self.write(line)
+
+    def write(self, data):
+        if self.transport and self.connected:
+            self.transport.write(data)
+
+class FakePoolFactory(protocol.ServerFactory):
+    protocol = PoolProtocol
+
+    def __init__(self, latency=0.0, latency_jitter=0.0, reject_ratio=0.0, seed=1):
+        self.latency = latency # Seconds before every response
+        self.latency_jitter = latency_jitter
+        self.reject_ratio = reject_ratio
+        self.silent = False # Connections stay open, but nothing is answered or pushed
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.clients = set()
+        self.job = None
+        self.job_number = 0
+        self.job_time = None # When current job was pushed
+        self.headers = deque(maxlen=3) # Shares of last few jobs are accepted, like real pools do
+        self.shares = set() # (nonce, header) of accepted shares
+        self.stats = {'connections': 0, 'jobs': 0, 'accepted': 0, 'rejected': 0, 'stale': 0,
+                      'duplicate': 0, 'hashrates': 0, 'bad_requests': 0, 'disconnects': 0}
+        self.new_job()
+
+    def get_latency(self):
+        if not self.latency_jitter:
+            return self.latency
+        return max(0.0, self.random.gauss(self.latency, self.latency_jitter))
+
+    def new_job(self):
+        '''Make new job and push it to every connected proxy'''
+        self.job_number += 1
+        # Pools with different seed never send the same header
+        header = '0x' + hashlib.sha256('fake-pool-%d-job-%d' % (self.seed, self.job_number)).hexdigest()
+        self.job = [header, SEED_HASH, BOUNDARY]
+        self.headers.append(header)
+        self.job_time = time.time()
+        self.stats['jobs'] += 1
+        if self.silent:
+            return self.job
+        line = json.dumps({'id': 0, 'jsonrpc': '2.0', 'result': self.job}) + '\n'
+        for client in list(self.clients):
+            client.write(line)
+        return self.job
+
+    def check_share(self, params):
+        if len(params) < 3 or params[1] not in self.headers:
+            self.stats['stale'] += 1
+            self.stats['rejected'] += 1
+            return False
+        key = (str(params[0]).lower(), str(params[1]).lower())
+        if key in self.shares:
+            self.stats['duplicate'] += 1
+            self.stats['rejected'] += 1
+            return False
+        if self.random.random() < self.reject_ratio:
+            self.stats['rejected'] += 1
+            return False
+        self.shares.add(key)
+        self.stats['accepted'] += 1
+        return True
+
+    def disconnect_all(self):
+        '''Drop every proxy connection, they will reconnect'''
+        for client in list(self.clients):
+            client.transport.loseConnection()
+        self.stats['disconnects'] += 1
+
+class FakePool(object):
+    '''Listening pool which can go down and come back up'''
+    def __init__(self, factory, port, interface='127.0.0.1'):
+        self.factory = factory
+        self.port = port
+        self.interface = interface
+        self.listener = None
+
+    def start(self):
+        self.listener = reactor.listenTCP(self.port, self.factory, interface=self.interface)
+        self.port = self.listener.getHost().port
+        return self.port
+
+    def go_down(self):
+        '''Close listening socket and all connections, proxy sees pool outage'''
+        if self.listener:
+            self.listener.stopListening()
+            self.listener = None
+        self.factory.disconnect_all()
+
+    def come_up(self):
+        if not self.listener:
+            self.start()
+        self.factory.silent = False
+
+    def go_silent(self):
+        '''Keep connections open but stop answering, like a hung pool server'''
+        self.factory.silent = True
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Ethereum stratum pool for eth-proxy tests and benchmarks")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=3333)
+    parser.add_argument('--job-interval', type=float, default=15, help="seconds between new jobs, 0 disables")
+    parser.add_argument('--job-jitter', type=float, default=0, help="random part of job interval, seconds")
+    parser.add_argument('--latency', type=float, default=0, help="response delay in ms")
+    parser.add_argument('--latency-jitter', type=float, default=0, help="standard deviation of response delay in ms")
+    parser.add_argument('--reject-ratio', type=float, default=0, help="fraction of valid shares to reject")
+    parser.add_argument('--disconnect-every', type=float, default=0, help="drop all connections every N seconds")
+    parser.add_argument('--down-for', type=float, default=0, help="with --disconnect-every, refuse connections for N seconds")
+    parser.add_argument('--silent', action='store_true', help="with --down-for, keep connections open but stop answering")
+    parser.add_argument('--stats-interval', type=float, default=10, help="print counters every N seconds")
+    parser.add_argument('--seed', type=int, default=1, help="seed of random choices")
+    args = parser.parse_args()
+
+    factory = FakePoolFactory(args.latency / 1000.0, args.latency_jitter / 1000.0, args.reject_ratio, args.seed)
+    pool = FakePool(factory, args.port, args.host)
+    pool.start()
+    print "Fake pool listening on %s:%d" % (args.host, pool.port)
+
+    def schedule_job():
+        delay = args.job_interval + factory.random.uniform(-args.job_jitter, args.job_jitter)
+        reactor.callLater(max(delay, 0.1), push_job)
+    def push_job():
+        factory.new_job()
+        schedule_job()
+    if args.job_interval:
+        schedule_job()
+
+    def outage():
+        if args.down_for and args.silent:
+            print "Pool going silent for %.1fs" % args.down_for
+            pool.go_silent()
+            reactor.callLater(args.down_for, pool.come_up)
+        elif args.down_for:
+            print "Pool going down for %.1fs" % args.down_for
+            pool.go_down()
+            reactor.callLater(args.down_for, pool.come_up)
+        else:
+            print "Dropping %d connections" % len(factory.clients)
+            factory.disconnect_all()
+    if args.disconnect_every:
+        task.LoopingCall(outage).start(args.disconnect_every, now=False)
+
+    def print_stats():
+        print "%s clients %d %s" % (time.strftime('%H:%M:%S'), len(factory.clients),
+                                    ' '.join([ '%s %d' % item for item in sorted(factory.stats.items()) ]))
+        sys.stdout.flush()
+    if args.stats_interval:
+        task.LoopingCall(print_stats).start(args.stats_interval, now=False)
+    reactor.addSystemEventTrigger('before', 'shutdown', print_stats)
+
+    reactor.run()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+'''
+    Load generator for the getwork listener (getwork_listener.Root).
+
+    Simulates many ethminer-like rigs over keep-alive HTTP: every client polls
+    eth_getWork, submits shares for the last received job as a Poisson process
+    and reports eth_submitHashrate periodically. Part of clients use worker-ID
+    path (http://host:port/rigN), the rest post to the root path.
+
+    Reports throughput and p50/p99/p999 latency per method, reactor lag of the
+    load generator and RSS of the load generator and of the proxy (--pid),
+    and writes the same results as JSON (--output) to compare versions.
+
+    With --standalone the getwork listener is started in this process with
+    a fake pool which accepts every share, so no pool or proxy is needed.
+    Load generator and proxy then share one CPU, use it for relative numbers.
+
+    Many clients need many sockets, raise "ulimit -n" first.
+
+    Usage: python tools/loadgen.py [--url http://127.0.0.1:8080] [--clients 1000] [--duration 30]
+'''
+
+import os
+import sys
+import time
+import json
+import random
+import resource
+import argparse
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from twisted.internet import reactor, defer, task
+from twisted.web.client import Agent, HTTPConnectionPool, readBody
+from twisted.web.http_headers import Headers
+from twisted.web.iweb import IBodyProducer
+from zope.interface import implementer
+
+from mining_libs import version
+
+METHODS = ('eth_getWork', 'eth_submitWork', 'eth_submitHashrate')
+
+def get_rss(pid='self'):
+    '''Resident memory of process in kB, None when unknown'''
+    try:
+        for line in open('/proc/%s/status' % pid):
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    except IOError:
+        pass
+    if pid == 'self':
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return None
+
+def percentile(values, fraction):
+    '''values must be sorted'''
+    if not values:
+        return None
+    return values[min(len(values)-1, int(fraction * len(values)))]
+
+@implementer(IBodyProducer)
+class StringProducer(object):
+    '''Request body written at once, FileBodyProducer would spread it over reactor iterations'''
+    def __init__(self, body):
+        self.body = body
+        self.length = len(body)
+
+    def startProducing(self, consumer):
+        consumer.write(self.body)
+        return defer.succeed(None)
+
+    def pauseProducing(self):
+        pass
+
+    def resumeProducing(self):
+        pass
+
+    def stopProducing(self):
+        pass
+
+class MethodStats(object):
+    def __init__(self):
+        self.latencies = [] # Seconds of every answered request
+        self.errors = 0 # Answered with JSON-RPC error or false result
+        self.failures = 0 # Connection or HTTP failure
+
+    def get_report(self, duration):
+        latencies = sorted(self.latencies)
+        ms = lambda value: round(value * 1000, 3) if value != None else None
+        return {'requests': len(latencies), 'errors': self.errors, 'failures': self.failures,
+                'rps': round(len(latencies) / duration, 1),
+                'p50_ms': ms(percentile(latencies, 0.5)), 'p99_ms': ms(percentile(latencies, 0.99)),
+                'p999_ms': ms(percentile(latencies, 0.999)), 'max_ms': ms(latencies[-1] if latencies else None)}
+
+class ReactorLag(object):
+    '''Measures how late the reactor runs a periodic call'''
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.lags = []
+        self.last = None
+        self.loop = task.LoopingCall(self.tick)
+
+    def start(self):
+        self.last = time.time()
+        self.loop.start(self.interval, now=False)
+
+    def tick(self):
+        now = time.time()
+        self.lags.append(max(now - self.last - self.interval, 0.0))
+        self.last = now
+
+    def get_report(self):
+        lags = sorted(self.lags)
+        ms = lambda value: round(value * 1000, 3) if value != None else None
+        return {'p50_ms': ms(percentile(lags, 0.5)), 'p99_ms': ms(percentile(lags, 0.99)),
+                'max_ms': ms(lags[-1] if lags else None)}
+
+class Client(object):
+    '''One simulated rig'''
+    def __init__(self, agent, url, args, stats, number):
+        self.agent = agent
+        self.url = url
+        self.args = args
+        self.stats = stats
+        self.number = number
+        self.header = None
+        self.polling = False
+        self.request_id = 0
+        self.miner_id = '0x%064x' % random.getrandbits(256)
+        self.hashrate = int(random.uniform(0.5, 1.5) * args.hashrate)
+        self.loops = []
+        self.submit_call = None
+        self.running = False
+
+    def start(self):
+        self.running = True
+        poll = task.LoopingCall(self.poll)
+        poll.start(self.args.poll_interval, now=True)
+        self.loops.append(poll)
+        if self.args.hashrate_interval:
+            hashrate = task.LoopingCall(self.submit_hashrate)
+            hashrate.start(self.args.hashrate_interval, now=False)
+            self.loops.append(hashrate)
+        self.schedule_submit()
+
+    def stop(self):
+        self.running = False
+        for loop in self.loops:
+            loop.stop()
+        if self.submit_call and self.submit_call.active():
+            self.submit_call.cancel()
+
+    def schedule_submit(self):
+        if self.running and self.args.submit_rate:
+            self.submit_call = reactor.callLater(random.expovariate(self.args.submit_rate), self.submit_work)
+
+    def request(self, method, params):
+        self.request_id += 1
+        body = json.dumps({'id': self.request_id, 'jsonrpc': '2.0', 'method': method, 'params': params})
+        start = time.time()
+        d = self.agent.request('POST', self.url, Headers({'Content-Type': ['application/json']}),
+                               StringProducer(body))
+        d.addCallback(self.on_response, method, start)
+        d.addErrback(self.on_failure, method)
+        return d
+
+    def on_response(self, response, method, start):
+        d = readBody(response)
+        d.addCallback(self.on_body, response.code, method, start)
+        return d
+
+    def on_body(self, body, code, method, start):
+        stats = self.stats[method]
+        stats.latencies.append(time.time() - start)
+        try:
+            message = json.loads(body)
+        except ValueError:
+            message = None
+        if code != 200 or not isinstance(message, dict) or message.get('error') or message.get('result') in (None, False):
+            stats.errors += 1
+            return None
+        return message['result']
+
+    def on_failure(self, failure, method):
+        self.stats[method].failures += 1
+        return None
+
+    @defer.inlineCallbacks
+    def poll(self):
+        if self.polling:
+            # Previous poll is still waiting, ethminer polls synchronously too
+            return
+        self.polling = True
+        try:
+            result = yield self.request('eth_getWork', [])
+            if isinstance(result, list) and result:
+                self.header = result[0]
+        finally:
+            self.polling = False
+
+    def submit_work(self):
+        if self.header:
+            self.request('eth_submitWork', ['0x%016x' % random.getrandbits(64), self.header,
+                                            '0x%064x' % random.getrandbits(256)])
+        self.schedule_submit()
+
+    def submit_hashrate(self):
+        self.request('eth_submitHashrate', ['0x%x' % self.hashrate, self.miner_id])
+
+def start_standalone():
+    '''Serve getwork_listener.Root from this process with a pool which accepts every share'''
+    import logging
+    from twisted.web.server import Site
+    from mining_libs import getwork_listener
+    from mining_libs import jobs
+
+    class FakePool(object):
+        is_connected = True
+        pool_number = 0
+        remote_ip = '127.0.0.1'
+        main_host = ('fake-pool', 0)
+
+        def rpc(self, method, params, worker_name):
+            return defer.succeed(True)
+
+    # Every share would be logged otherwise
+    logging.getLogger('proxy').setLevel(logging.WARNING)
+
+    job_registry = jobs.JobRegistry([FakePool()])
+    job_registry.update_active_pool()
+    job_registry.install_job(jobs.Job.build_from_pool(["0x%064x" % random.getrandbits(256), "0x%064x" % 0,
+                                                       "0x%064x" % (2**256 // 4000000000)]))
+    port = reactor.listenTCP(0, Site(getwork_listener.Root(job_registry, True)), interface='127.0.0.1')
+    return 'http://127.0.0.1:%d' % port.getHost().port
+
+def report(args, stats, lag, duration, rss_start, proxy_rss_start):
+    result = {'version': version.VERSION, 'time': int(time.time()),
+              'config': {'url': args.url, 'clients': args.clients, 'duration': args.duration,
+                         'poll_interval': args.poll_interval, 'submit_rate': args.submit_rate,
+                         'hashrate_interval': args.hashrate_interval, 'worker_id_ratio': args.worker_id_ratio,
+                         'standalone': args.standalone},
+              'duration': round(duration, 3),
+              'methods': dict([ (method, stats[method].get_report(duration)) for method in METHODS ]),
+              'reactor_lag': lag.get_report(),
+              'rss_kb': {'loadgen_start': rss_start, 'loadgen_end': get_rss()}}
+    result['total_rps'] = round(sum([ method_stats['rps'] for method_stats in result['methods'].values() ]), 1)
+    if args.pid:
+        result['rss_kb']['proxy_start'] = proxy_rss_start
+        result['rss_kb']['proxy_end'] = get_rss(args.pid)
+
+    print "%d clients, %.1fs, %.1f requests/s" % (args.clients, duration, result['total_rps'])
+    for method in METHODS:
+        item = result['methods'][method]
+        print "  %-20s %8d req %8.1f/s  p50 %s ms  p99 %s ms  p999 %s ms  errors %d  failures %d" % (method,
+              item['requests'], item['rps'], item['p50_ms'], item['p99_ms'], item['p999_ms'], item['errors'], item['failures'])
+    print "  reactor lag          p50 %(p50_ms)s ms  p99 %(p99_ms)s ms  max %(max_ms)s ms" % result['reactor_lag']
+    print "  RSS kB               %s" % ', '.join([ "%s %s" % (name, rss) for (name, rss) in sorted(result['rss_kb'].items()) ])
+
+    if args.output:
+        fp = open(args.output, 'w')
+        json.dump(result, fp, indent=2, sort_keys=True)
+        fp.close()
+        print "Results written to %s" % args.output
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator for eth-proxy getwork listener")
+    parser.add_argument('--url', default='http://127.0.0.1:8080', help="getwork listener of proxy")
+    parser.add_argument('--standalone', action='store_true', help="serve getwork listener from this process with fake pool")
+    parser.add_argument('--clients', type=int, default=1000, help="simulated rigs")
+    parser.add_argument('--duration', type=float, default=30, help="seconds of load")
+    parser.add_argument('--ramp', type=float, default=5, help="clients are started over this many seconds")
+    parser.add_argument('--poll-interval', type=float, default=0.5, help="seconds between eth_getWork polls of one client")
+    parser.add_argument('--submit-rate', type=float, default=0.05, help="shares per second of one client")
+    parser.add_argument('--hashrate-interval', type=float, default=10, help="seconds between eth_submitHashrate of one client, 0 disables")
+    parser.add_argument('--hashrate', type=int, default=30000000, help="average reported hashrate of one client, H/s")
+    parser.add_argument('--worker-id-ratio', type=float, default=1.0, help="fraction of clients using /rigN path")
+    parser.add_argument('--pid', help="process id of proxy to report its RSS")
+    parser.add_argument('--output', help="write results as JSON into this file")
+    args = parser.parse_args()
+
+    if args.standalone:
+        args.url = start_standalone()
+
+    pool = HTTPConnectionPool(reactor, persistent=True)
+    pool.maxPersistentPerHost = args.clients
+    pool.retryAutomatically = False
+    agent = Agent(reactor, pool=pool)
+
+    stats = dict([ (method, MethodStats()) for method in METHODS ])
+    clients = []
+    for number in xrange(args.clients):
+        if random.random() < args.worker_id_ratio:
+            url = '%s/rig%d' % (args.url.rstrip('/'), number)
+        else:
+            url = args.url.rstrip('/') + '/'
+        client = Client(agent, url, args, stats, number)
+        clients.append(client)
+        reactor.callLater(random.uniform(0, args.ramp), client.start)
+
+    lag = ReactorLag()
+    lag.start()
+    rss_start = get_rss()
+    proxy_rss_start = get_rss(args.pid) if args.pid else None
+
+    # Measure only once all clients run
+    def reset():
+        for item in stats.values():
+            item.__init__()
+        lag.lags = []
+        started[0] = time.time()
+    started = [time.time()]
+    reactor.callLater(args.ramp, reset)
+
+    def finish():
+        duration = time.time() - started[0]
+        for client in clients:
+            if client.running:
+                client.stop()
+        lag.loop.stop()
+        try:
+            report(args, stats, lag, duration, rss_start, proxy_rss_start)
+        finally:
+            reactor.stop()
+    reactor.callLater(args.ramp + args.duration, finish)
+
+    reactor.run()
+
+if __name__ == '__main__':
+    main()
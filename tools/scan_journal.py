@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+'''
+    Summarizes share journal written by the proxy (mining_libs/journal.py).
+
+    Prints shares by verdict and average pool latency per worker, pool, day
+    or hour. Journal files are read whole, weeks of records take seconds.
+
+    Usage: python tools/scan_journal.py [files] [--by worker|pool|day|hour] [--since 24] [--worker rig1]
+           python tools/scan_journal.py --generate 5000000 --days 14   (synthetic journal for benchmarks)
+
+    Without files, all journal files in JOURNAL_DIR are read.
+'''
+
+import os
+import sys
+import glob
+import time
+import random
+import argparse
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from stratum import settings
+from mining_libs import journal
+
+def scan(paths, since, worker, group):
+    '''Returns (records, {key: [count per verdict..., latency sum, latency count]})'''
+    rows = {}
+    count = 0
+    width = len(journal.VERDICTS)
+    (unpack_from, header_size) = (journal.RECORD.unpack_from, journal.RECORD.size)
+    period = 86400 if group == 'day' else 3600
+    for path in paths:
+        fp = open(path, 'rb')
+        try:
+            data = fp.read()
+        finally:
+            fp.close()
+        # Loop of journal.read_records() inlined, generator would take a third of scan time
+        (offset, size) = (0, len(data))
+        while offset+header_size <= size:
+            (marker, timestamp, latency, pool_number, verdict, nonce, header, name_len) = unpack_from(data, offset)
+            end = offset + header_size + name_len
+            if marker != journal.RECORD_MARKER or end > size:
+                print "%s: broken record at offset %d, rest of file skipped" % (path, offset)
+                break
+            worker_name = data[offset+header_size:end]
+            offset = end
+            if timestamp < since or (worker != None and worker_name != worker):
+                continue
+
+            if group == 'worker':
+                key = worker_name
+            elif group == 'pool':
+                key = pool_number
+            else:
+                key = int(timestamp // period) * period
+            row = rows.get(key)
+            if row == None:
+                row = rows[key] = [0] * (width + 2)
+            if verdict < width:
+                row[verdict] += 1
+            if verdict <= journal.REJECTED:
+                row[width] += latency
+                row[width+1] += 1
+            count += 1
+    return (count, rows)
+
+def format_key(key, group):
+    if group == 'pool':
+        return "none" if key == journal.NO_POOL else ("main" if key == 0 else "failover%d" % key)
+    if group == 'day':
+        return time.strftime('%Y-%m-%d', time.gmtime(key))
+    if group == 'hour':
+        return time.strftime('%Y-%m-%d %H:00', time.gmtime(key))
+    return key or "(no worker id)"
+
+def generate(args):
+    '''Writes synthetic journal of args.generate records spread over args.days days until now'''
+    if not os.path.isdir(settings.JOURNAL_DIR):
+        os.makedirs(settings.JOURNAL_DIR)
+    now = time.time()
+    step = args.days * 86400.0 / args.generate
+    header = "0x%064x" % random.getrandbits(256)
+    (path, fp) = (None, None)
+    for number in xrange(args.generate):
+        timestamp = now - args.days * 86400 + number * step
+        if journal.get_path(settings.JOURNAL_DIR, timestamp) != path:
+            if fp:
+                fp.close()
+            path = journal.get_path(settings.JOURNAL_DIR, timestamp)
+            fp = open(path, 'ab')
+        if number % 1000 == 0:
+            header = "0x%064x" % random.getrandbits(256)
+        verdict = journal.ACCEPTED if random.random() < 0.97 else random.choice((journal.REJECTED, journal.STALE, journal.DUPLICATE))
+        fp.write(journal.pack(timestamp, random.uniform(20, 80), random.choice((0, 0, 0, 1)), verdict,
+                              "0x%016x" % random.getrandbits(64), header, "rig%d" % random.randint(1, 100)))
+    if fp:
+        fp.close()
+    print "%d records written to %s" % (args.generate, settings.JOURNAL_DIR)
+
+def main():
+    parser = argparse.ArgumentParser(description="Summary of eth-proxy share journal")
+    parser.add_argument('files', nargs='*', help="journal files, default all in JOURNAL_DIR")
+    parser.add_argument('--by', choices=('worker', 'pool', 'day', 'hour'), default='worker')
+    parser.add_argument('--since', type=float, help="only records of last N hours")
+    parser.add_argument('--worker', help="only records of this worker")
+    parser.add_argument('--generate', type=int, help="write N synthetic records into JOURNAL_DIR instead")
+    parser.add_argument('--days', type=int, default=14, help="with --generate, spread records over N days")
+    args = parser.parse_args()
+
+    if args.generate:
+        generate(args)
+        return
+
+    paths = args.files or sorted(glob.glob(os.path.join(settings.JOURNAL_DIR, 'shares-*.bin')))
+    if not paths:
+        print "No journal files in %s" % settings.JOURNAL_DIR
+        return
+    since = time.time() - args.since * 3600 if args.since else 0
+    if args.since:
+        # Skip files of days before since
+        day = time.strftime('%Y%m%d', time.gmtime(since))
+        paths = [ path for path in paths if journal.get_day(path) >= day ]
+
+    start = time.time()
+    (count, rows) = scan(paths, since, args.worker, args.by)
+    duration = time.time() - start
+
+    width = len(journal.VERDICTS)
+    print "%-20s %s %10s %9s" % (args.by, ' '.join([ "%10s" % name for name in journal.VERDICTS ]), "accepted%", "latency")
+    totals = [0] * (width + 2)
+    for key in sorted(rows):
+        row = rows[key]
+        totals = [ a+b for a, b in zip(totals, row) ]
+        shares = sum(row[:width])
+        print "%-20s %s %9.2f%% %7.1fms" % (format_key(key, args.by), ' '.join([ "%10d" % value for value in row[:width] ]),
+                                            100.0 * row[journal.ACCEPTED] / shares if shares else 0.0,
+                                            row[width] / row[width+1] if row[width+1] else 0.0)
+    shares = sum(totals[:width])
+    print "%-20s %s %9.2f%% %7.1fms" % ("total", ' '.join([ "%10d" % value for value in totals[:width] ]),
+                                        100.0 * totals[journal.ACCEPTED] / shares if shares else 0.0,
+                                        totals[width] / totals[width+1] if totals[width+1] else 0.0)
+    print "\n%d records in %d files scanned in %.2fs (%.0f records/s)" % (count, len(paths), duration, count / duration if duration else 0)
+
+if __name__ == '__main__':
+    main()